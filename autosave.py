@@ -0,0 +1,135 @@
+import os
+import time
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from magic_rpg import Game
+from binary_snapshot import write_binary_snapshot
+from game.setup import delta_file, write_snapshot
+
+# periodic full saves that don't stop the game for the length of the save. the world is captured between ticks, then
+# written out while the game carries on:
+#   fork     (where available) the child process gets a copy-on-write copy of the world as it was and writes it, so the
+#            game only pauses for the fork itself
+#   thread   otherwise the objects are copied to plain dicts on the game thread, and encoded and written on another
+# either way the snapshot is written to a temporary file and renamed into place, so a crash mid-save leaves the old one.
+# the command log is rotated at the capture point so nothing logged during the save is lost.
+
+@dataclass
+class AutosaveStats:
+    captures : int = 0
+    saves : int = 0
+    failures : int = 0
+    last_pause : float = 0.0 # seconds the game was stopped to capture the world
+    max_pause : float = 0.0
+    total_pause : float = 0.0
+    last_duration : float = 0.0 # seconds from the capture until the snapshot was in place
+
+    def record_pause(self, pause : float):
+        self.captures += 1
+        self.last_pause = pause
+        self.max_pause = max(self.max_pause, pause)
+        self.total_pause += pause
+
+class Autosave:
+    METHODS = ("fork", "thread")
+
+    def __init__(self, game : Game, file : str, interval : float, binary : bool = False, method : str = None):
+        if method == None:
+            method = "fork" if hasattr(os, "fork") else "thread"
+        if method not in Autosave.METHODS:
+            raise ValueError(f"Unknown autosave method {method}.")
+        self.game : Game = game
+        self.file : str = file
+        self.interval : float = interval # seconds of game time between saves
+        self.binary : bool = binary
+        self.method : str = method
+        self.stats : AutosaveStats = AutosaveStats()
+        self.next_save : float = None
+        self._executor : ThreadPoolExecutor = None
+        self._pid : int = None
+        self._future : Future = None
+        self._changes = None
+        self._started : float = 0.0
+        game.autosave = self
+
+    def in_progress(self) -> bool:
+        return self._pid != None or self._future != None
+
+    def due(self) -> bool:
+        if self.next_save == None:
+            self.next_save = self.game.game_time + self.interval
+        return not self.in_progress() and self.game.game_time >= self.next_save
+
+    def start(self):
+        # call between ticks
+        if self.in_progress():
+            return
+        self._started = time.perf_counter()
+        header = self.game.dump_header()
+        if self.method == "fork":
+            pid = os.fork()
+            if pid == 0:
+                code = 0
+                try:
+                    self._write(header, self.game.iter_object_dicts())
+                except BaseException:
+                    traceback.print_exc()
+                    code = 1
+                # skip all cleanup, none of it belongs to this process
+                os._exit(code)
+            self._pid = pid
+        else:
+            objects = [ self.game.obj_to_dict(obj) for obj in self.game.all_objects() ]
+            if self._executor == None:
+                self._executor = ThreadPoolExecutor(max_workers=1)
+            self._future = self._executor.submit(self._write, header, objects)
+        self._changes = self.game.take_changes()
+        if self.game.command_log != None:
+            self.game.command_log.rotate()
+        self.stats.record_pause(time.perf_counter() - self._started)
+        self.next_save = self.game.game_time + self.interval
+
+    def poll(self):
+        # call once per tick, finishes off a save which has completed
+        if self._pid != None:
+            pid, status = os.waitpid(self._pid, os.WNOHANG)
+            if pid != 0:
+                self._finish(os.waitstatus_to_exitcode(status) == 0)
+        elif self._future != None and self._future.done():
+            self._finish(self._future.exception() == None)
+
+    def wait(self):
+        # blocks until the save in progress, if any, has finished
+        if self._pid != None:
+            _, status = os.waitpid(self._pid, 0)
+            self._finish(os.waitstatus_to_exitcode(status) == 0)
+        elif self._future != None:
+            try:
+                self._future.result()
+            except Exception:
+                traceback.print_exc()
+            self._finish(self._future.exception() == None)
+
+    def _write(self, header : dict, objects):
+        if self.binary:
+            write_binary_snapshot(self.file, header, objects)
+        else:
+            write_snapshot(self.file, header, objects)
+
+    def _finish(self, succeeded : bool):
+        self._pid = None
+        self._future = None
+        if succeeded:
+            # no deltas are written during a save, so everything in the delta file is in the snapshot now
+            if os.path.exists(delta_file(self.file)):
+                os.remove(delta_file(self.file))
+            if self.game.command_log != None:
+                self.game.command_log.discard_rotated()
+            self.stats.saves += 1
+        else:
+            # keep the rotated log and the changes, the next delta or save still needs them
+            self.game.restore_changes(self._changes)
+            self.stats.failures += 1
+        self._changes = None
+        self.stats.last_duration = time.perf_counter() - self._started
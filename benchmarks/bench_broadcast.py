@@ -0,0 +1,54 @@
+# cost of room chat and announcements as the audience grows: every listener's frame encoded on its own, as the server
+# used to, against each message encoded once and the frames put together from the encoded parts.
+# run from the repository root with: python -m benchmarks.bench_broadcast [listeners ...]
+import sys
+import time
+from interfaces.magic_io import RichText
+from interfaces.wire import encode_message, encode_output, frame_from_parts
+from benchmarks.world import make_game, make_avatar
+
+ROUNDS = 200
+
+def per_recipient(sink : list):
+    def output_stream(user, msgs):
+        sink.append(encode_output(msgs))
+    return output_stream
+
+def encoded_once(sink : list):
+    def output_stream(user, parts):
+        sink.append(frame_from_parts(parts))
+    return output_stream
+
+def timed_rounds(interface, run) -> float:
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        run()
+        interface.flush()
+    return (time.perf_counter() - start) / ROUNDS
+
+def main(sizes : list[int]):
+    print(f"{'listeners':>10} {'path':>10} {'say us':>10} {'announce us':>12}")
+    for size in sizes:
+        game, interface = make_game()
+        game.add_object(game.obj_from_dict({ "id": "room", "state": { "name": "Room", "description": "A room." } }))
+        avatars = []
+        for i in range(size):
+            avatar = make_avatar(game, f"listener{i}", "room")
+            interface.add_user(f"listener{i}", avatar.id)
+            avatars.append(avatar.id)
+        announcement = RichText("The server will restart soon.", color=1, bold=True)
+
+        frames = dict()
+        for path, encoders, make_stream in (("each", None, per_recipient), ("once", { "json": encode_message }, encoded_once)):
+            sink = []
+            interface.encoders = encoders
+            interface.output_stream = make_stream(sink)
+            say = timed_rounds(interface, lambda : game.parse("say hello everyone", avatars[0]))
+            announce = timed_rounds(interface, lambda : interface.broadcast(announcement))
+            frames[path] = sink
+            print(f"{size:>10} {path:>10} {say * 1e6:>10.1f} {announce * 1e6:>12.1f}")
+        # both paths have to put the same bytes on the wire
+        assert frames["each"] == frames["once"]
+
+if __name__ == "__main__":
+    main([ int(arg) for arg in sys.argv[1:] ] or [1, 10, 100, 1000])
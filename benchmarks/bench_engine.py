@@ -0,0 +1,124 @@
+# throughput and latency of the main game operations on a generated world, written as json so runs on different commits
+# can be compared. run from the repository root with: python -m benchmarks.bench_engine [--rooms N ...] [--output FILE]
+import argparse
+import asyncio
+import json
+import platform
+import subprocess
+import sys
+import time
+from typing import Callable
+from magic_rpg import Game
+from benchmarks.world import World, WorldSpec, generate_world, make_avatar, make_game
+
+def percentile(ordered : list[float], q : float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def summarize(samples : list[float]) -> dict:
+    ordered = sorted(samples)
+    total = sum(ordered)
+    return {
+        "count": len(ordered),
+        "total_s": total,
+        "ops_per_s": len(ordered) / total if total > 0 else None,
+        "p50_ms": percentile(ordered, 0.50) * 1000,
+        "p99_ms": percentile(ordered, 0.99) * 1000,
+        "max_ms": ordered[-1] * 1000
+    }
+
+async def measure(iterations : int, operation : Callable[[int], None]) -> dict:
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        operation(i)
+        samples.append(time.perf_counter() - start)
+        await asyncio.sleep(0)
+    return summarize(samples)
+
+def command(world : World, raw : str) -> Callable[[int], None]:
+    # commands go straight to Game.parse, which is what NetIO.poll calls once a command's turn comes, and their output is
+    # flushed as it would be at the end of the tick
+    def run(i : int):
+        world.game.parse(raw, world.avatars[i % len(world.avatars)])
+        world.interface.flush()
+    return run
+
+def login(world : World, saved : dict) -> Callable[[int], None]:
+    # the same steps as server.handler once the password is checked, then logging straight back out
+    def run(i : int):
+        game, interface = world.game, world.interface
+        avatar = game.obj_from_dict({ **saved, "id": f"login{i}" })
+        game.add_object(avatar)
+        game.log("add", obj=game.obj_to_dict(avatar))
+        interface.add_user(f"login{i}", avatar.id)
+        interface.update_user(game.obj_to_dict(avatar))
+        game.remove_obj(avatar.id)
+        game.log("remove", id=avatar.id)
+        interface.remove_id(avatar.id)
+    return run
+
+async def run_benchmarks(spec : WorldSpec, iterations : int, state_iterations : int) -> dict:
+    world = generate_world(spec)
+    game = world.game
+    results = dict()
+    results["look"] = await measure(iterations, command(world, "look"))
+    results["say"] = await measure(iterations, command(world, "say hello everyone"))
+    results["go"] = await measure(iterations, command(world, "go door"))
+    results["tick"] = await measure(iterations, lambda i : game._run_tick())
+
+    saved = game.obj_to_dict(make_avatar(game, "saved", world.rooms[0]))
+    game.remove_obj(saved["id"])
+    results["login"] = await measure(iterations, login(world, saved))
+
+    state = game.dump_state()
+    results["dump_state"] = await measure(state_iterations, lambda i : game.dump_state())
+    def load(i : int):
+        loaded, _ = make_game()
+        loaded.load_state(state)
+    results["load_state"] = await measure(state_iterations, load)
+
+    return {
+        "objects": len(game.game_objects),
+        "messages_sent": world.sent[0],
+        "results": results
+    }
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the game engine on a generated world.")
+    parser.add_argument("--rooms", type=int, default=WorldSpec.rooms)
+    parser.add_argument("--objects", type=int, default=WorldSpec.objects_per_room, help="objects per room")
+    parser.add_argument("--avatars", type=int, default=WorldSpec.avatars)
+    parser.add_argument("--scripts", type=int, default=WorldSpec.tick_scripts, help="objects running a script every tick")
+    parser.add_argument("--seed", type=int, default=WorldSpec.seed)
+    parser.add_argument("--iterations", type=int, default=1000, help="runs of each command, tick and login")
+    parser.add_argument("--state-iterations", type=int, default=10, help="runs of dump_state and load_state")
+    parser.add_argument("--output", help="file to write the json results to, instead of stdout")
+    args = parser.parse_args()
+
+    spec = WorldSpec(args.rooms, args.objects, args.avatars, args.scripts, args.seed)
+    report = {
+        "benchmark": "engine",
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "time": time.time(),
+        "spec": spec.to_dict(),
+        "iterations": args.iterations,
+        **asyncio.run(run_benchmarks(spec, args.iterations, args.state_iterations))
+    }
+    text = json.dumps(report, indent=4)
+    if args.output == None:
+        print(text)
+    else:
+        with open(args.output, mode="w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        for name, result in report["results"].items():
+            print(f"{name:12} {result['ops_per_s']:12,.0f}/s  p50 {result['p50_ms']:8.3f} ms  p99 {result['p99_ms']:8.3f} ms", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# bytes per object for a world of simple objects (items, coins, doors...). run from the repository root with:
+# python -m benchmarks.bench_memory [counts...]
+import gc
+import json
+import sys
+import tracemalloc
+import uuid
+from magic_rpg import Game
+from game.utilities import create_object, create_instance
+
+# objects loaded from a save each get their own copy of every string, which is what copy() simulates
+DESCRIPTION = "A small gold coin, worn smooth by many hands. The face on it belongs to some king nobody remembers."
+
+def copy(text : str) -> str:
+    return text.encode().decode()
+
+class LegacyGameObject:
+    # what GameObject looked like before it was slotted, for comparison
+    def __init__(self, id = None):
+        self.id : str = str(uuid.uuid4()) if id == None else id
+        self.states : dict = dict()
+        self.skills : set = set()
+        self.reactions : set = set()
+
+def fill_legacy(count : int):
+    objects = dict()
+    for i in range(count):
+        obj = LegacyGameObject()
+        obj.states["name"] = copy("coin")
+        obj.states["description"] = copy(DESCRIPTION)
+        obj.states["location"] = f"room{i % 1000}"
+        objects[obj.id] = obj
+    return objects
+
+def fill_game(count : int):
+    game = Game()
+    for i in range(count):
+        create_object(game, copy("coin"), copy(DESCRIPTION), f"room{i % 1000}")
+    return game
+
+def fill_instances(count : int):
+    game = Game()
+    coin = create_object(game, "coin", DESCRIPTION)
+    for i in range(count):
+        create_instance(game, coin.id, f"room{i % 1000}")
+    return game
+
+def measure(fill, count : int) -> tuple[float, float]:
+    gc.collect()
+    tracemalloc.start()
+    world = fill(count)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    snapshot = len(json.dumps(world.dump_state())) if isinstance(world, Game) else 0
+    del world
+    gc.collect()
+    return current / count, snapshot / count
+
+def main():
+    counts = [ int(arg) for arg in sys.argv[1:] ] or [ 10 ** 5, 10 ** 6 ]
+    fills = { "legacy": fill_legacy, "GameObject": fill_game, "instances": fill_instances }
+    print(f"{'objects':>10}" + "".join(f"{name:>16}" for name in fills) + f"{'snapshot (GameObject / instances)':>40}")
+    for count in counts:
+        results = [ measure(fill, count) for fill in fills.values() ]
+        print(
+            f"{count:>10}" + "".join(f"{memory:>10.0f} bytes" for memory, _ in results)
+            + f"{results[1][1]:>26.0f} / {results[2][1]:.0f} bytes"
+        )
+
+if __name__ == "__main__":
+    main()
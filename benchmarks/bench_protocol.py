@@ -0,0 +1,76 @@
+# bandwidth and cpu per message of the json and binary wire protocols, with and without permessage-deflate, over a stream
+# of typical output frames. deflate is done the way permessage-deflate does it, one compressor kept for the whole
+# connection and flushed after every message, so repeated type names and styles are mostly compressed away already.
+# run from the repository root with: python -m benchmarks.bench_protocol [--frames N] [--window-bits B] ...
+import argparse
+import json
+import random
+import time
+import zlib
+from interfaces.magic_io import RichText, COLOR
+from interfaces.wire import JSON, BINARY, decode_binary_frame
+
+WORDS = "the a door room north south look here who is going to open that old chest by the window hello again".split()
+
+def make_message(rng : random.Random):
+    # the same kinds of output as benchmarks.bench_wire, with varying text so deflate can't just repeat the last frame
+    kind = rng.choices(["plain", "say", "welcome", "look"], [3, 4, 1, 2])[0]
+    name = f"bot{rng.randrange(1000)}"
+    if kind == "plain":
+        return rng.choice(["You can't see that.", "say WORDS", "You're sending commands too quickly; that one was ignored."])
+    elif kind == "say":
+        return [RichText(name + ": ", COLOR.YELLOW), " ".join(rng.choices(WORDS, k=rng.randint(2, 12)))]
+    elif kind == "welcome":
+        return RichText(f"Welcome to the server, {name}.", color=1, bold=True)
+    room = rng.randrange(100)
+    things = [ item for i in rng.sample(range(50), rng.randint(1, 10)) for item in (RichText(f"thing{i}", COLOR.GREEN), ", ") ]
+    return [RichText(f"Room {room}", COLOR.CYAN, bold=True), "\n", f"Room number {room}.", "\n", *things, RichText("door", COLOR.GREEN)]
+
+def make_frames(count : int, seed : int) -> list[list]:
+    # mostly single messages, with the odd tick where a user gets several
+    rng = random.Random(seed)
+    return [ [ make_message(rng) for _ in range(rng.choice([1, 1, 1, 2, 3])) ] for _ in range(count) ]
+
+def deflate(frames : list, window_bits : int, mem_level : int, level : int) -> tuple[int, float]:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -window_bits, mem_level)
+    size = 0
+    start = time.perf_counter()
+    for frame in frames:
+        data = frame.encode("ascii") if isinstance(frame, str) else frame
+        # permessage-deflate leaves out the empty block's 00 00 ff ff at the end of every message
+        size += len(compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+    return size, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the json and binary wire protocols.")
+    parser.add_argument("--frames", type=int, default=20000)
+    parser.add_argument("--window-bits", type=int, default=12)
+    parser.add_argument("--mem-level", type=int, default=5)
+    parser.add_argument("--level", type=int, default=6)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    batches = make_frames(args.frames, args.seed)
+    messages = sum(len(batch) for batch in batches)
+    print(f"{messages} messages in {len(batches)} frames, deflate window {args.window_bits} bits, "
+          f"memLevel {args.mem_level}, level {args.level}\n")
+    print(f"{'protocol':>8} {'B/msg':>8} {'deflated B/msg':>15} {'encode us':>10} {'decode us':>10} {'deflate us':>11}")
+    decoded = dict()
+    for protocol, decode in ((JSON, json.loads), (BINARY, decode_binary_frame)):
+        start = time.perf_counter()
+        frames = [ protocol.encode_output(batch) for batch in batches ]
+        encode_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        decoded[protocol.name] = [ decode(frame) for frame in frames ]
+        decode_time = time.perf_counter() - start
+
+        size = sum(len(frame) for frame in frames)
+        deflated, deflate_time = deflate(frames, args.window_bits, args.mem_level, args.level)
+        print(f"{protocol.name:>8} {size / messages:>8.1f} {deflated / messages:>15.1f} {encode_time / messages * 1e6:>10.2f} "
+              f"{decode_time / messages * 1e6:>10.2f} {deflate_time / messages * 1e6:>11.2f}")
+    # the client has to see the same thing either way
+    assert decoded["json"] == decoded["binary"]
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+# replay throughput of the command log. run from the repository root with: python -m benchmarks.bench_replay
+import json
+import os
+import random
+import tempfile
+import time
+from magic_rpg import Game, GameObject
+from interfaces.NetIO import NetIO
+from command_log import CommandLog
+from game.setup import game_setup
+
+COMMANDS = [ "look", "look box", "say hello", "go door", "say \"I can shout!\"" ]
+
+def make_game() -> Game:
+    game = Game(0.5)
+    game.set_interface(NetIO(game.parse, None, None))
+    game_setup(game)
+    return game
+
+def make_avatar(game : Game, name : str) -> GameObject:
+    avatar = GameObject(game.new_id())
+    avatar.states = { "name": name, "description": f"Avatar for {name}.", "location": "room" }
+    game.imbue_reactions(avatar, ["listen_can_hear", "look_visible"])
+    game.imbue_skills(avatar, ["look", "go", "say"])
+    return avatar
+
+def write_log(file : str, game : Game, avatars : int, commands : int, commands_per_tick : int) -> int:
+    rng = random.Random(0)
+    seq = 0
+    tick = game.tick_number
+    ids = []
+    with open(file, mode="w", encoding="utf-8") as f:
+        for i in range(avatars):
+            avatar = make_avatar(game, f"bot{i}")
+            ids.append(avatar.id)
+            seq += 1
+            f.write(json.dumps({ "seq": seq, "tick": tick, "type": "add", "obj": game.obj_to_dict(avatar) }) + "\n")
+        for i in range(commands):
+            if i % commands_per_tick == 0:
+                tick += 1
+            seq += 1
+            f.write(json.dumps({ "seq": seq, "tick": tick, "type": "command", "id": rng.choice(ids), "raw": rng.choice(COMMANDS) }) + "\n")
+    return seq
+
+def main():
+    for avatars, commands, per_tick in [ (10, 10000, 5), (100, 100000, 50) ]:
+        with tempfile.TemporaryDirectory() as tmp:
+            file = os.path.join(tmp, "commands.log")
+            records = write_log(file, make_game(), avatars, commands, per_tick)
+
+            game = make_game()
+            start = time.perf_counter()
+            game.replay(CommandLog.read(file))
+            elapsed = time.perf_counter() - start
+            print(f"{avatars} avatars, {records} records over {game.tick_number} ticks: {elapsed:.2f} s, {records / elapsed:,.0f} records/s")
+
+if __name__ == "__main__":
+    main()
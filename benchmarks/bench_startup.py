@@ -0,0 +1,59 @@
+# startup time of a large world, json snapshot against the memory mapped binary one.
+# run from the repository root with: python -m benchmarks.bench_startup [objects] [rooms]
+import os
+import sys
+import tempfile
+import time
+from magic_rpg import Game
+from interfaces.NetIO import NetIO
+from binary_snapshot import write_binary_snapshot
+from game.setup import game_state_load, write_snapshot
+
+def make_header() -> dict:
+    return { "game_time": 0.0, "tick_number": 0, "log_seq": 0, "id_namespace": "bench", "next_id": 0, "listeners": {}, "timers": [] }
+
+def make_objects(objects : int, rooms : int):
+    for i in range(rooms):
+        yield { "id": f"room{i}", "state": { "name": f"Room {i}", "description": "A room." }, "reactions": [], "skills": [] }
+    for i in range(objects - rooms):
+        yield { "id": f"obj{i}", "state": { "name": f"thing{i}", "description": "A thing.", "location": f"room{i % rooms}" },
+                "reactions": [ "look_visible" ], "skills": [] }
+
+def make_game() -> Game:
+    game = Game(0.5)
+    game.set_interface(NetIO(game.parse, None, None))
+    return game
+
+def timed(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+def main(objects : int, rooms : int):
+    directory = tempfile.mkdtemp()
+    json_file = os.path.join(directory, "world.json")
+    binary_file = os.path.join(directory, "world.bin")
+
+    print(f"writing {objects} objects in {rooms} rooms")
+    print(f"  json   {timed(lambda : write_snapshot(json_file, make_header(), make_objects(objects, rooms))):8.2f} s"
+          f"  {os.path.getsize(json_file) / 1e6:8.1f} MB")
+    print(f"  binary {timed(lambda : write_binary_snapshot(binary_file, make_header(), make_objects(objects, rooms))):8.2f} s"
+          f"  {os.path.getsize(binary_file) / 1e6:8.1f} MB")
+
+    game = make_game()
+    print(f"json load         {timed(lambda : game_state_load(game, json_file)):8.3f} s  ({len(game.game_objects)} objects in memory)")
+    del game
+
+    game = make_game()
+    print(f"binary attach     {timed(lambda : game_state_load(game, binary_file)):8.3f} s  ({len(game.game_objects)} objects in memory)")
+    print(f"first room        {timed(lambda : game.get_in_location('room0')):8.3f} s  ({len(game.game_objects)} objects in memory)")
+    print(f"1000 lookups      {timed(lambda : [ game.get_by_id(f'obj{i * 997 % (objects - rooms)}') for i in range(1000) ]):8.3f} s")
+
+    for file in (json_file, binary_file):
+        os.remove(file)
+    os.rmdir(directory)
+
+if __name__ == "__main__":
+    objects = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    rooms = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    main(objects, rooms)
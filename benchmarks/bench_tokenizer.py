@@ -0,0 +1,50 @@
+# microbenchmark for the command tokenizer. run from the repository root with: python -m benchmarks.bench_tokenizer
+import timeit
+import tokenizer
+
+def split_args_legacy(raw: str) -> list[str]:
+    # the character by character loop Game and Client used before tokenizer.py, kept for comparison
+    i = 0
+    buffer = ""
+    quoting = False
+    arg_list = []
+    while i < len(raw):
+        buffer += raw[i]
+        if raw[i] == " " and not quoting:
+            arg_list.append(buffer[:-1])
+            buffer = ""
+        if raw[i] in "\"\'" and not quoting:
+            quoting = True
+            buffer = ""
+        elif raw[i] in "\"\'" and quoting:
+            quoting = False
+            buffer = buffer[:-1]
+        i += 1
+    if len(buffer) > 0:
+        arg_list.append(buffer)
+    return arg_list
+
+CASES = {
+    "short": "look door",
+    "quoted": "say \"I can shout!\"",
+    "create": "create Box 'A plain wooden box with a lid.' box_1",
+    "long": "say \"" + "lorem ipsum dolor sit amet " * 200 + "\""
+}
+
+def bench(fn, raw : str, number : int) -> float:
+    return min(timeit.repeat(lambda : fn(raw), number=number, repeat=5)) / number
+
+def main():
+    implementations = {
+        "legacy": split_args_legacy,
+        "split_args": tokenizer.split_args,
+        "split_args_cached": tokenizer.split_args_cached
+    }
+    print(f"{'case':<10}{'chars':>8}" + "".join(f"{name:>20}" for name in implementations))
+    for case, raw in CASES.items():
+        number = 200 if len(raw) > 1000 else 20000
+        timings = [ bench(fn, raw, number) * 1e6 for fn in implementations.values() ]
+        print(f"{case:<10}{len(raw):>8}" + "".join(f"{t:>17.2f} us" for t in timings))
+
+if __name__ == "__main__":
+    main()
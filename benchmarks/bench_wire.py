@@ -0,0 +1,73 @@
+# size and encode time of typical messages, the wire encoder against the dataclass path the server used before it
+# (format_message -> asdict -> json.dumps, with every style field sent). also checks the client reads both the same.
+# run from the repository root with: python -m benchmarks.bench_wire [iterations]
+import asyncio
+import json
+import sys
+import time
+from dataclasses import dataclass, asdict
+from types import NoneType
+from typing import Union
+from interfaces.magic_io import RichText, COLOR
+from interfaces.wire import encode_output
+from client import Client
+
+@dataclass
+class Output:
+    type : str
+    content : Union[RichText, str, list, NoneType]
+
+@dataclass
+class SendData:
+    type: str
+    data : Union[NoneType, Output]
+
+def format_message(msg):
+    if isinstance(msg, RichText):
+        return Output("RichText", msg)
+    elif isinstance(msg, str):
+        return Output("PlainText", msg)
+    elif isinstance(msg, list):
+        return Output("List", [ format_message(item) for item in msg ])
+
+def encode_dataclasses(msg) -> str:
+    return json.dumps(asdict(SendData("output", format_message(msg))))
+
+MESSAGES = {
+    "plain": "You can't see that.",
+    "say": [RichText("bot12: ", COLOR.YELLOW), "hello everyone"],
+    "welcome": RichText("Welcome to the server, bot12.", color=1, bold=True),
+    "look": [RichText("Room 3", COLOR.CYAN, bold=True), "\n", "Room number 3.", "\n",
+             *[ item for i in range(8) for item in (RichText(f"thing{i}", COLOR.GREEN), ", ") ], RichText("door", COLOR.GREEN)]
+}
+
+class RecordingIO:
+    def __init__(self):
+        self.output = []
+
+    def add_output(self, output):
+        self.output.append(output)
+
+def decoded(frame : str) -> list:
+    client = Client()
+    client.io = RecordingIO()
+    asyncio.run(Client.parse_message(client, frame))
+    return client.io.output
+
+def per_message(encode, msg, iterations : int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        encode(msg)
+    return (time.perf_counter() - start) / iterations
+
+def main(iterations : int):
+    print(f"{'message':>10} {'old bytes':>10} {'new bytes':>10} {'old us':>8} {'new us':>8}")
+    for name, msg in MESSAGES.items():
+        old, new = encode_dataclasses(msg), encode_output([msg])
+        assert decoded(old) == decoded(new), name
+        old_time = per_message(encode_dataclasses, msg, iterations)
+        new_time = per_message(lambda msg : encode_output([msg]), msg, iterations)
+        print(f"{name:>10} {len(old):>10} {len(new):>10} {old_time * 1e6:>8.2f} {new_time * 1e6:>8.2f}")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
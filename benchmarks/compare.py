@@ -0,0 +1,24 @@
+# compares two json results from bench_engine (or anything with the same "results" layout):
+#   python -m benchmarks.compare OLD.json NEW.json
+import json
+import sys
+
+def main(old_file : str, new_file : str):
+    with open(old_file, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_file, encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"{'':12} {'p50 old':>10} {'p50 new':>10} {'p99 old':>10} {'p99 new':>10} {'change':>8}")
+    for name, result in new["results"].items():
+        before = old["results"].get(name)
+        if before == None:
+            print(f"{name:12} {'':>10} {result['p50_ms']:10.3f} {'':>10} {result['p99_ms']:10.3f}")
+            continue
+        change = (result["p50_ms"] - before["p50_ms"]) / before["p50_ms"] * 100 if before["p50_ms"] > 0 else 0.0
+        print(f"{name:12} {before['p50_ms']:10.3f} {result['p50_ms']:10.3f} {before['p99_ms']:10.3f} {result['p99_ms']:10.3f} {change:+7.1f}%")
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python -m benchmarks.compare OLD.json NEW.json")
+        sys.exit(1)
+    main(sys.argv[1], sys.argv[2])
@@ -0,0 +1,186 @@
+# a crowd of headless players for load testing a running server. every bot is a Client with its screen swapped for a
+# counter, so it speaks the same protocol and reads replies through Client.parse_message.
+# run from the repository root, with the server up, with: python -m benchmarks.swarm [--bots N ...] [--output FILE]
+#
+# a command's round trip is timed from sending it to the next output the bot receives. output a bot didn't ask for (other
+# players talking, welcome messages) can end a round trip early, so with a chatty mix treat the numbers as a lower bound.
+import argparse
+import asyncio
+import json
+import platform
+import random
+import time
+from websockets import client as ws
+from websockets.exceptions import ConnectionClosed
+from client import Client, connect_message, disconnect
+from benchmarks.bench_engine import git_commit, percentile
+
+DEFAULT_MIX = "look:4,say hello:2,go door:1"
+
+class HeadlessIO:
+    # stands in for CursesIO, Client only ever adds output to it
+    def __init__(self, stats : "SwarmStats"):
+        self.stats : SwarmStats = stats
+        self.received : asyncio.Event = asyncio.Event()
+
+    def add_output(self, output):
+        self.stats.messages += 1
+        self.received.set()
+
+class SwarmStats:
+    def __init__(self):
+        self.connects : list[float] = [] # seconds from opening the socket until the first output
+        self.failed_connects : int = 0
+        self.round_trips : list[float] = []
+        self.timeouts : int = 0
+        self.dropped : int = 0 # sessions the server closed before the bot was done
+        self.messages : int = 0
+        self.first_connect : float = None
+        self.last_connect : float = None
+
+    def connected(self, at : float, elapsed : float):
+        self.connects.append(elapsed)
+        self.first_connect = at if self.first_connect == None else min(self.first_connect, at)
+        self.last_connect = at if self.last_connect == None else max(self.last_connect, at)
+
+def parse_mix(mix : str) -> tuple[list[str], list[int]]:
+    # "look:4,say hello:2" -> commands and their weights
+    commands, weights = [], []
+    for entry in mix.split(","):
+        command, _, weight = entry.rpartition(":")
+        commands.append(command.strip())
+        weights.append(int(weight))
+    return commands, weights
+
+class Bot(Client):
+    def __init__(self, name : str, password : str, stats : SwarmStats, rng : random.Random):
+        super().__init__()
+        self.name : str = name
+        self.password : str = password
+        self.stats : SwarmStats = stats
+        self.rng : random.Random = rng
+        self.io : HeadlessIO = HeadlessIO(stats)
+
+    async def wait_for_output(self, timeout : float) -> bool:
+        try:
+            await asyncio.wait_for(self.io.received.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def play(self, uri : str, until : float, commands : list[str], weights : list[int], think : float, timeout : float):
+        start = time.perf_counter()
+        try:
+            self.connection = await ws.connect(uri)
+        except Exception:
+            self.stats.failed_connects += 1
+            return
+        self.cur_user = self.name
+        self.io.received.clear()
+        await self.connection.send(connect_message(self.name, self.password, self.protocols))
+        receiving = asyncio.create_task(self.receive_message())
+        # the server welcomes everybody who logs in, so the first output is our own welcome
+        try:
+            if not await self.wait_for_output(timeout):
+                self.stats.failed_connects += 1
+                return
+            now = time.perf_counter()
+            self.stats.connected(now, now - start)
+            while time.perf_counter() < until and self.connection != None:
+                await asyncio.sleep(self.rng.uniform(0, 2 * think))
+                self.io.received.clear()
+                sent = time.perf_counter()
+                await self.parse(self.rng.choices(commands, weights)[0])
+                if await self.wait_for_output(timeout):
+                    self.stats.round_trips.append(time.perf_counter() - sent)
+                else:
+                    self.stats.timeouts += 1
+        except ConnectionClosed:
+            self.stats.dropped += 1
+        finally:
+            try:
+                await disconnect(self)
+            except ConnectionClosed:
+                pass
+            await asyncio.gather(receiving, return_exceptions=True)
+
+def summarize_latencies(samples : list[float]) -> dict:
+    if len(samples) == 0:
+        return { "count": 0 }
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "p50_ms": percentile(ordered, 0.50) * 1000,
+        "p90_ms": percentile(ordered, 0.90) * 1000,
+        "p99_ms": percentile(ordered, 0.99) * 1000,
+        "max_ms": ordered[-1] * 1000
+    }
+
+async def run_swarm(uri : str, bots : int, ramp : float, duration : float, think : float, timeout : float, mix : str, seed : int,
+                    protocol : str = "json") -> dict:
+    commands, weights = parse_mix(mix)
+    stats = SwarmStats()
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    until = start + bots / ramp + duration
+    tasks = []
+    for i in range(bots):
+        bot = Bot(f"swarm{i}", f"swarm{i}", stats, random.Random(rng.random()))
+        bot.protocols = [protocol]
+        tasks.append(asyncio.create_task(bot.play(uri, until, commands, weights, think, timeout)))
+        await asyncio.sleep(1 / ramp)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+
+    connect_span = (stats.last_connect - stats.first_connect) if len(stats.connects) > 1 else None
+    return {
+        "connections": {
+            "succeeded": len(stats.connects),
+            "failed": stats.failed_connects,
+            "per_s": len(stats.connects) / connect_span if connect_span else None,
+            "latency": summarize_latencies(stats.connects)
+        },
+        "commands": {
+            "sent": len(stats.round_trips) + stats.timeouts,
+            "timeouts": stats.timeouts,
+            "dropped_sessions": stats.dropped,
+            "round_trip": summarize_latencies(stats.round_trips)
+        },
+        "messages": {
+            "received": stats.messages,
+            "per_s": stats.messages / elapsed
+        },
+        "elapsed_s": elapsed
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a running server with headless bots.")
+    parser.add_argument("--uri", default="ws://localhost:8001")
+    parser.add_argument("--bots", type=int, default=100)
+    parser.add_argument("--ramp", type=float, default=50.0, help="bots started per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds to keep playing once every bot has started")
+    parser.add_argument("--think", type=float, default=1.0, help="mean seconds a bot waits between commands")
+    parser.add_argument("--timeout", type=float, default=10.0, help="seconds to wait for a reply before giving up on it")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="comma separated COMMAND:WEIGHT")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--protocol", choices=["json", "binary"], default="json", help="wire protocol the bots ask for")
+    parser.add_argument("--output", help="file to write the json results to, instead of stdout")
+    args = parser.parse_args()
+
+    report = {
+        "benchmark": "swarm",
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "time": time.time(),
+        "settings": { key: value for key, value in vars(args).items() if key != "output" },
+        **asyncio.run(run_swarm(args.uri, args.bots, args.ramp, args.duration, args.think, args.timeout, args.mix, args.seed, args.protocol))
+    }
+    text = json.dumps(report, indent=4)
+    if args.output == None:
+        print(text)
+    else:
+        with open(args.output, mode="w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+if __name__ == "__main__":
+    main()
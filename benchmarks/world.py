@@ -0,0 +1,85 @@
+# generates worlds of a given size for the benchmarks, out of the same pieces as game_setup
+from dataclasses import dataclass, asdict
+import random
+from magic_rpg import Game, GameObject, EventDataOnTick, Script
+from interfaces.NetIO import NetIO
+from game.setup import SKILLS, REACTIONS, SCRIPTS
+from game.utilities import create_object, create_instance
+
+@dataclass
+class WorldSpec:
+    rooms : int = 10
+    objects_per_room : int = 10
+    avatars : int = 10
+    tick_scripts : int = 0 # objects with a script listening to the tick event
+    seed : int = 0
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+@dataclass
+class World:
+    game : Game
+    interface : NetIO
+    rooms : list[str]
+    avatars : list[str]
+    sent : list[int] # messages sent to avatars so far, in a list so the output callback can count into it
+
+def bench_on_tick(game : Game, caller_id, ev_data : EventDataOnTick):
+    obj : GameObject = game.get_by_id(caller_id)
+    obj.states["ticks"] = obj.states.get("ticks", 0) + 1
+
+BENCH_SCRIPTS = { Script("bench_on_tick", bench_on_tick) }
+
+def make_game(sent : list[int] = None) -> tuple[Game, NetIO]:
+    if sent == None:
+        sent = [0]
+    def count_output(user, msgs):
+        sent[0] += len(msgs)
+    game = Game(0.5)
+    interface = NetIO(game.parse, count_output, lambda name, data : None)
+    game.set_interface(interface)
+    game.add_skills(SKILLS)
+    game.add_reactions(REACTIONS)
+    game.add_scripts(SCRIPTS)
+    game.add_scripts(BENCH_SCRIPTS)
+    return game, interface
+
+def make_avatar(game : Game, name : str, location : str) -> GameObject:
+    avatar = create_object(game, name, f"Avatar for {name}.", location)
+    game.imbue_reactions(avatar, ["listen_can_hear", "look_visible"])
+    game.imbue_skills(avatar, ["look", "go", "say"])
+    return avatar
+
+def generate_world(spec : WorldSpec) -> World:
+    # rooms in a ring, each with a door to the next one, so "go door" always goes somewhere
+    rng = random.Random(spec.seed)
+    sent = [0]
+    game, interface = make_game(sent)
+
+    door = create_object(game, "door", "A door.", id="door")
+    game.imbue_reactions(door, ["look_visible", "go_can_go"])
+    rooms = []
+    for i in range(spec.rooms):
+        room = create_object(game, f"Room {i}", f"Room number {i}.", id=f"room{i}")
+        game.imbue_reaction(room, "look_visible")
+        rooms.append(room.id)
+    for i, room_id in enumerate(rooms):
+        create_instance(game, door.id, room_id, destination=rooms[(i + 1) % len(rooms)])
+        for j in range(spec.objects_per_room):
+            obj = create_object(game, f"thing{j}", f"Thing {j} in room {i}.", room_id)
+            game.imbue_reaction(obj, "look_visible")
+
+    for i in range(spec.tick_scripts):
+        obj = create_object(game, f"ticker{i}", "Something that ticks.", rng.choice(rooms))
+        game.imbue_reaction(obj, "look_visible")
+        game.register_event("tick", obj.id, "bench_on_tick")
+
+    avatars = []
+    for i in range(spec.avatars):
+        avatar = make_avatar(game, f"bot{i}", rng.choice(rooms))
+        interface.add_user(f"bot{i}", avatar.id)
+        avatars.append(avatar.id)
+
+    game.checkpoint()
+    return World(game, interface, rooms, avatars, sent)
@@ -0,0 +1,166 @@
+import json
+import mmap
+import os
+import struct
+from typing import Iterable, Iterator
+
+# a snapshot format that can be opened without reading it. layout, all little endian:
+#
+#   preamble    magic, version and the offset / size of every section below
+#   payloads    one compact json document per object (states, skills, reactions, prototype)
+#   strings     u32 offsets (count + 1 of them) then the utf-8 bytes of every id and location
+#   records     fixed width (id string, location string, payload offset, payload length), sorted by location then id,
+#               so everything in one location is a contiguous run
+#   id index    u32 record numbers sorted by id, for binary search by id
+#   header      the json snapshot header (clock, listeners, timers)
+#
+# objects are only decoded when asked for, so a world of millions of objects opens in the time it takes to map the file.
+
+MAGIC = b"MAGB"
+VERSION = 1
+PREAMBLE = struct.Struct("<4sI6Q") # magic, version, strings, string count, records, record count, id index, header
+RECORD = struct.Struct("<IIQI")
+INDEX = struct.Struct("<I")
+NO_LOCATION = 0xFFFFFFFF
+
+def is_binary_snapshot(file : str) -> bool:
+    with open(file, mode="rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+def write_binary_snapshot(file : str, header : dict, objects : Iterable[dict]):
+    strings : dict[str, int] = dict()
+    def intern(text : str) -> int:
+        index = strings.get(text)
+        if index == None:
+            index = len(strings)
+            strings[text] = index
+        return index
+
+    records = []
+    tmp_file = file + ".tmp"
+    with open(tmp_file, mode="wb") as f:
+        f.write(bytes(PREAMBLE.size))
+        offset = PREAMBLE.size
+        for obj in objects:
+            payload = { "state": obj.get("state"), "reactions": obj.get("reactions"), "skills": obj.get("skills") }
+            if obj.get("prototype") != None:
+                payload["prototype"] = obj["prototype"]
+            data = json.dumps(payload, separators=(",", ":")).encode()
+            f.write(data)
+            location = obj.get("state", {}).get("location")
+            records.append((location, obj["id"], offset, len(data)))
+            offset += len(data)
+
+        # no location sorts first, then by location and id
+        records.sort(key=lambda r : (r[0] != None, r[0] or "", r[1]))
+
+        strings_offset = offset
+        encoded = []
+        for location, obj_id, _, _ in records:
+            intern(obj_id)
+            if location != None:
+                intern(location)
+        position = 0
+        for text in strings:
+            data = text.encode()
+            encoded.append(data)
+            f.write(INDEX.pack(position))
+            position += len(data)
+        f.write(INDEX.pack(position))
+        for data in encoded:
+            f.write(data)
+        offset = strings_offset + INDEX.size * (len(strings) + 1) + position
+
+        records_offset = offset
+        for location, obj_id, payload_offset, length in records:
+            f.write(RECORD.pack(strings[obj_id], NO_LOCATION if location == None else strings[location], payload_offset, length))
+        offset += RECORD.size * len(records)
+
+        id_index_offset = offset
+        for record_number in sorted(range(len(records)), key=lambda i : records[i][1]):
+            f.write(INDEX.pack(record_number))
+        offset += INDEX.size * len(records)
+
+        header_offset = offset
+        f.write(json.dumps(header).encode())
+
+        f.seek(0)
+        f.write(PREAMBLE.pack(MAGIC, VERSION, strings_offset, len(strings), records_offset, len(records), id_index_offset, header_offset))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, file)
+
+class BinarySnapshot:
+    def __init__(self, file : str):
+        self.file : str = file
+        self._f = open(file, mode="rb")
+        self._map = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self._strings, self._string_count, self._records, self.count, self._id_index, self._header = PREAMBLE.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{file} isn't a version {VERSION} binary snapshot.")
+        self._string_data = self._strings + INDEX.size * (self._string_count + 1)
+
+    def close(self):
+        self._map.close()
+        self._f.close()
+
+    def header(self) -> dict:
+        return json.loads(self._map[self._header:])
+
+    def string(self, index : int) -> str:
+        start, end = struct.unpack_from("<II", self._map, self._strings + INDEX.size * index)
+        return self._map[self._string_data + start:self._string_data + end].decode()
+
+    def _record(self, number : int) -> tuple[int, int, int, int]:
+        return RECORD.unpack_from(self._map, self._records + RECORD.size * number)
+
+    def _record_id(self, number : int) -> str:
+        return self.string(self._record(number)[0])
+
+    def _location_key(self, number : int) -> tuple[bool, str]:
+        location = self._record(number)[1]
+        return (False, "") if location == NO_LOCATION else (True, self.string(location))
+
+    def find(self, obj_id : str) -> int:
+        # record number for the id, or None
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            number = INDEX.unpack_from(self._map, self._id_index + INDEX.size * middle)[0]
+            found = self._record_id(number)
+            if found == obj_id:
+                return number
+            if found < obj_id:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def load(self, obj_id : str) -> dict:
+        # the object as Game.obj_from_dict expects it, or None
+        number = self.find(obj_id)
+        if number == None:
+            return None
+        _, _, offset, length = self._record(number)
+        data = json.loads(self._map[offset:offset + length])
+        data["id"] = obj_id
+        return data
+
+    def ids_in_location(self, location : str) -> list[str]:
+        key = (True, location)
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._location_key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        ids = []
+        while low < self.count and self._location_key(low) == key:
+            ids.append(self._record_id(low))
+            low += 1
+        return ids
+
+    def iter_ids(self) -> Iterator[str]:
+        for number in range(self.count):
+            yield self._record_id(number)
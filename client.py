@@ -9,6 +9,8 @@ import time
 import json
 
 import websockets
+import tokenizer
+from interfaces.wire import decode_binary_frame
 from interfaces.magic_io import *
 from interfaces.CursesIO import *
 
@@ -33,6 +35,20 @@ class SendData:
     type: str
     data : Union[NoneType, Output]
 
+# the messages a client sends; the server answers with "output" and "disconnect" messages, see Client.strategies
+def connect_message(user : str, password : str, protocols : list[str] = None) -> str:
+    # protocols in order of preference, servers which don't know about them send json anyway
+    message = { "type": "connect", "user": user, "pass": password }
+    if protocols != None:
+        message["protocol"] = protocols
+    return json.dumps(message)
+
+def command_message(raw : str) -> str:
+    return json.dumps({"type":"message", "data": raw})
+
+def disconnect_message(user : str) -> str:
+    return json.dumps({"type": "disconnect", "user": user})
+
 async def help(client : "Client", args):
     client.io.add_output("HELP")
     for cmd in Client._default_commands:
@@ -56,7 +72,7 @@ async def connect(client : "Client", args):
         connection = await ws.connect(args[1])
         client.connection = connection
         client.cur_user = args[2]
-        await client.connection.send(json.dumps({ "type": "connect", "user": args[2], "pass": args[3] }))
+        await client.connection.send(connect_message(args[2], args[3], client.protocols))
         client.io.add_output(f"Connected to {args[1]} successfully.")
         asyncio.create_task(client.receive_message())
     except:
@@ -67,7 +83,7 @@ async def disconnect(client: "Client", send_header: bool = True):
     if client.connection != None:
         client.disconnecting.set() # stop receiving in the receive loop
         if send_header:
-            await client.connection.send(json.dumps({"type": "disconnect", "user": client.cur_user}))
+            await client.connection.send(disconnect_message(client.cur_user))
         await client.connection.close()
         client.cur_user = None
         client.connection = None
@@ -86,6 +102,7 @@ class Client:
         self.tick_time = tick_time
         self.connection = None
         self.cur_user = None
+        self.protocols : list[str] = ["binary", "json"]
 
     async def receive_loop():
         pass
@@ -95,38 +112,14 @@ class Client:
         obj = json.loads(message)
 
 
-    @staticmethod
-    def split_args(raw: str) -> list[str]:
-        i = 0
-        start = 0
-        buffer = ""
-        quoting = False
-        arg_list = []
-        while i < len(raw):
-            buffer += raw[i]
-            if raw[i] == " " and not quoting:
-                arg_list.append(buffer[:-1])
-                start = i+1
-                buffer = ""
-            if raw[i] in "\"\'" and not quoting:
-                quoting = True
-                start = i
-                buffer = ""
-            elif raw[i] in "\"\'" and quoting:
-                quoting = False
-                buffer = buffer[:-1]
-            i += 1
-        if len(buffer) > 0:
-            arg_list.append(buffer)
-        return arg_list
-
+    split_args = staticmethod(tokenizer.split_args)
 
     async def parse(self, raw : str):
         split = Client.split_args(raw)
         if len(split) > 0 and split[0] in Client._default_commands:
             await Client._default_commands[split[0]][1](self, split)
         elif self.connection != None:
-            await self.connection.send(json.dumps({"type":"message", "data": raw}))
+            await self.connection.send(command_message(raw))
     
     # example_message = {
     #     "type": "output",
@@ -154,9 +147,10 @@ class Client:
         if not "text" in body or not isinstance(body["text"], str):
             return None
 
-        # check fields and remove fields not in the spec programatically, exploiting dataclass functions
+        # check fields and remove fields not in the spec programatically, exploiting dataclass functions.
+        # the server leaves out style fields at their default, which RichText fills back in
 
-        rt_fields = dict( (f.name, f.type) for f in fields(RichText))
+        rt_fields = Client.rich_text_fields
         new_body = dict()
 
         for key in body:
@@ -188,6 +182,8 @@ class Client:
     def parse_list(client : "Client", body : list):
         out = []
         for msg in body:
+            if not isinstance(msg, dict):
+                continue
             content_type = msg.get("type")
             if content_type == None:
                 continue
@@ -207,6 +203,8 @@ class Client:
 
     @staticmethod
     def parse_output(client : "Client", output : dict):
+        if not isinstance(output, dict):
+            return
         content_type = output.get("type")
         if content_type == None:
             return
@@ -220,21 +218,31 @@ class Client:
 
     @staticmethod
     async def parse_output_message(client : "Client", message : dict):
-        print(message)
         output = message.get("data")
-        print (output)
         if output == None:
             return
 
         Client.parse_output(client, output)
             
 
-    strategies = { "output" : parse_output_message, "disconnect": parse_disconnect }
+    @staticmethod
+    async def parse_batch_message(client : "Client", message : dict):
+        # several outputs from the same server tick
+        outputs = message.get("data")
+        if not isinstance(outputs, list):
+            return
+
+        for output in outputs:
+            Client.parse_output(client, output)
+
+    rich_text_fields = dict( (f.name, f.type) for f in fields(RichText) )
+    strategies = { "output" : parse_output_message, "batch": parse_batch_message, "disconnect": parse_disconnect }
     output_strategies = { "RichText" : parse_rich_text, "PlainText" : parse_plain_text, "List": parse_list }
 
     @staticmethod
-    async def parse_message(client: "Client", message : str):
-        obj = json.loads(message)
+    async def parse_message(client: "Client", message : Union[str, bytes]):
+        # binary messages are frames in the binary protocol, text ones are json
+        obj = decode_binary_frame(message) if isinstance(message, bytes) else json.loads(message)
         obj_type = obj.get("type")
         if obj_type == None:
             return
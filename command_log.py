@@ -0,0 +1,76 @@
+import json
+import os
+from typing import Iterator
+
+# an append-only log of everything that changes the world from outside the game itself (player commands, logins, logouts),
+# tagged with the tick it happened in. replaying it on top of the last snapshot gets back to where we were before a crash.
+# while a snapshot is being written in the background the log is rotated, the old part is kept until the snapshot is in
+# place. replay skips records the snapshot already covers by their sequence number.
+
+ROTATED_SUFFIX = ".old"
+
+class CommandLog:
+    def __init__(self, file : str):
+        self.file : str = file
+        self._f = open(file, mode="a", encoding="utf-8")
+        self._unsynced : int = 0
+
+    def append(self, record : dict):
+        self._f.write(json.dumps(record) + "\n")
+        self._unsynced += 1
+
+    def sync(self):
+        # one fsync for everything appended since the last call, the game calls this once per tick
+        if self._unsynced == 0:
+            return
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._unsynced = 0
+
+    def truncate(self):
+        # once a snapshot covers everything in the log it isn't needed any more
+        self._f.close()
+        self._f = open(self.file, mode="w", encoding="utf-8")
+        self._unsynced = 0
+        self.discard_rotated()
+
+    def rotate(self):
+        # starts a new log, keeping the current one aside until discard_rotated is called
+        self.sync()
+        self._f.close()
+        rotated = self.file + ROTATED_SUFFIX
+        if os.path.exists(rotated):
+            # the last background save failed, so the older records are still needed
+            with open(rotated, mode="a", encoding="utf-8") as out, open(self.file, mode="r", encoding="utf-8") as f:
+                out.write(f.read())
+            os.remove(self.file)
+        else:
+            os.replace(self.file, rotated)
+        self._f = open(self.file, mode="a", encoding="utf-8")
+
+    def discard_rotated(self):
+        if os.path.exists(self.file + ROTATED_SUFFIX):
+            os.remove(self.file + ROTATED_SUFFIX)
+
+    def close(self):
+        self.sync()
+        self._f.close()
+
+    @staticmethod
+    def read(file : str) -> Iterator[dict]:
+        # the rotated log, if one was left behind, comes first
+        yield from CommandLog._read_file(file + ROTATED_SUFFIX)
+        yield from CommandLog._read_file(file)
+
+    @staticmethod
+    def _read_file(file : str) -> Iterator[dict]:
+        if not os.path.exists(file):
+            return
+        with open(file, mode="r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # the last line can be half written if we crashed mid-write; nothing after it was synced
+                    return
+                yield record
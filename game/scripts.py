@@ -1,4 +1,4 @@
-from magic_rpg import EventDataOnTick, Game, GameObject, Script
+from magic_rpg import EventDataOnTick, EventDataOnTimer, Game, GameObject, Script
 
 def shouter_on_tick(game : "Game", caller_id, ev_data : EventDataOnTick):
     tick_time = ev_data.cur_time
@@ -13,6 +13,15 @@ def shouter_on_tick(game : "Game", caller_id, ev_data : EventDataOnTick):
 
     shouter.states["last_tick"] = tick_time % shout_frequency
 
+def shouter_on_timer(game : "Game", caller_id, ev_data : EventDataOnTimer):
+    shouter : GameObject = game.get_by_id(caller_id)
+    if shouter == None:
+        return
+
+    game.use_skill("say \"I can shout!\"", caller_id)
+    game.schedule(float(shouter.states.get("shout_frequency")), caller_id, "shouter_on_timer")
+
 SCRIPTS = {
-    Script("shouter_on_tick", shouter_on_tick)
+    Script("shouter_on_tick", shouter_on_tick),
+    Script("shouter_on_timer", shouter_on_timer)
 }
\ No newline at end of file
@@ -1,9 +1,13 @@
 from magic_rpg import GameObject, Game, Skill, Reaction
-from game.utilities import create_object
+from binary_snapshot import BinarySnapshot, is_binary_snapshot, write_binary_snapshot
+from game.utilities import create_object, create_instance
 from game.skills import *
 from game.reactions import *
 from game.scripts import *
 import json
+from itertools import islice
+import os
+from typing import Iterable, Iterator
 
 def game_setup(game : Game):
 
@@ -13,20 +17,19 @@ def game_setup(game : Game):
 
     room = create_object(game, "Room", "A small room.", id="room")
     big_room = create_object(game, "Big Room", "A much bigger room.", id="big_room")
-    to_big_room = create_object(game, "door", "A big door.", location="room")
-    to_big_room.states["destination"] = "big_room"
-    to_small_room = create_object(game, "door", "A little door.", "big_room")
-    to_small_room.states["destination"] = "room"
+    door = create_object(game, "door", "A door.", id="door") # prototype for the doors, which only store what's different
+    to_big_room = create_instance(game, door.id, "room", description="A big door.", destination="big_room")
+    to_small_room = create_instance(game, door.id, "big_room", description="A little door.", destination="room")
     box = create_object(game, "Box", "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut labore et dolore magna aliqua. Ut enim ad minim veniam, quis nostrud exercitation ullamco laboris nisi ut aliquip ex ea commodo consequat. Duis aute irure dolor in reprehenderit in voluptate velit esse cillum dolore eu fugiat nulla pariatur. Excepteur sint occaecat cupidatat non proident, sunt in culpa qui officia deserunt mollit anim id est laborum.", "room")
     
     shouter = create_object(game, "Shouter", "An annoying shouty guy.", "room")
     shouter.states["last_shout"] = 0
     shouter.states["shout_frequency"] = 5
 
-    game.register_event("tick", shouter.id, "shouter_on_tick")
+    game.schedule(shouter.states["shout_frequency"], shouter.id, "shouter_on_timer")
 
-    can_see = { shouter, room, big_room, box, to_big_room, to_small_room }
-    can_go = { to_big_room, to_small_room }
+    can_see = { shouter, room, big_room, box, door }
+    can_go = { door }
 
     game.imbue_skill(shouter, "say")
 
@@ -36,17 +39,196 @@ def game_setup(game : Game):
     for obj in can_go:
         game.imbue_reaction(obj, "go_can_go")
 
-def game_state_load(game : Game, file : str):
+def delta_file(file : str) -> str:
+    # incremental saves are appended here, one json delta per line, until the next full save or compaction
+    return file + ".delta"
+
+# snapshots are newline delimited json: a header line (clock, listeners and timers) followed by one line per object, so
+# they can be written from a generator and read back a line at a time. older saves are a single json document, and
+# still load.
+SNAPSHOT_FORMAT = "magic-ndjson"
+SNAPSHOT_VERSION = 1
+LOAD_BATCH = 1000 # objects loaded between yields in iter_game_state_load
+
+def sync_file(f):
+    # on disk before anything relies on it, e.g. the command log being truncated once it's saved
+    f.flush()
+    os.fsync(f.fileno())
+
+def write_json_atomic(data, file : str, indent = None):
+    tmp_file = file + ".tmp"
+    with open(tmp_file, mode="w") as f:
+        json.dump(data, f, indent=indent)
+        sync_file(f)
+    os.replace(tmp_file, file)
+
+def write_snapshot(file : str, header : dict, objects : Iterable[dict]):
+    tmp_file = file + ".tmp"
+    with open(tmp_file, mode="w", encoding="utf-8") as f:
+        f.write(json.dumps({ "format": SNAPSHOT_FORMAT, "version": SNAPSHOT_VERSION, **header }) + "\n")
+        for obj in objects:
+            f.write(json.dumps(obj) + "\n")
+        sync_file(f)
+    os.replace(tmp_file, file)
+
+def read_snapshot(f) -> tuple[dict, Iterator[dict]]:
+    # returns the header and a generator over the objects, which reads the file as it goes
+    first_line = f.readline()
+    try:
+        header = json.loads(first_line)
+    except json.JSONDecodeError:
+        header = None
+
+    if not isinstance(header, dict) or header.get("format") != SNAPSHOT_FORMAT:
+        f.seek(0)
+        state = json.load(f)
+        return state, iter(state.pop("objects"))
+
+    def objects():
+        for line in f:
+            if len(line.strip()) > 0:
+                yield json.loads(line)
+
+    return header, objects()
+
+def read_deltas(file : str) -> Iterator[dict]:
+    if not os.path.exists(delta_file(file)):
+        return
+    with open(delta_file(file), mode="r") as f:
+        for line in f:
+            if len(line.strip()) == 0:
+                continue
+            try:
+                delta = json.loads(line)
+            except json.JSONDecodeError:
+                # half written when we crashed. the log wasn't truncated until the delta was synced, so replaying it
+                # covers whatever this was going to save
+                continue
+            yield delta
+
+def ends_mid_line(file : str) -> bool:
+    if not os.path.exists(file) or os.path.getsize(file) == 0:
+        return False
+    with open(file, mode="rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) != b"\n"
+
+def iter_game_state_load(game : Game, file : str, batch : int = LOAD_BATCH) -> Iterator[int]:
+    # loads a bit at a time, yielding the number of objects loaded so far so the caller can get on with other things
     game.add_skills(SKILLS)
     game.add_reactions(REACTIONS)
     game.add_scripts(SCRIPTS)
 
-    with open(file, mode="r") as f:
-        state = json.load(f)
-    
-    game.load_state(state)
+    loaded = 0
+    if is_binary_snapshot(file):
+        # nothing to read up front, objects come out of the snapshot as they're needed
+        game.attach_snapshot(BinarySnapshot(file))
+    else:
+        with open(file, mode="r", encoding="utf-8") as f:
+            header, objects = read_snapshot(f)
+            game.load_header(header)
+            while True:
+                chunk = list(islice(objects, batch))
+                if len(chunk) == 0:
+                    break
+                game.load_objects(chunk)
+                loaded += len(chunk)
+                yield loaded
+
+    for delta in read_deltas(file):
+        game.apply_delta(delta)
+
+    game.checkpoint()
+    yield loaded
+
+def game_state_load(game : Game, file : str):
+    for _ in iter_game_state_load(game, file):
+        pass
+
+def game_state_save(game : Game, file : str, binary : bool = False):
+    if binary:
+        write_binary_snapshot(file, game.dump_header(), game.iter_object_dicts())
+    else:
+        write_snapshot(file, game.dump_header(), game.iter_object_dicts())
+    if os.path.exists(delta_file(file)):
+        os.remove(delta_file(file))
+    game.checkpoint()
+
+def game_state_save_delta(game : Game, file : str):
+    # only writes what changed since the last save, so the cost scales with the changes rather than the world
+    if not game.has_changes():
+        return
+    # a delta cut short by a crash is skipped when reading, so don't run on from it
+    start = "\n" if ends_mid_line(delta_file(file)) else ""
+    with open(delta_file(file), mode="a") as f:
+        f.write(start + json.dumps(game.dump_delta()) + "\n")
+        sync_file(f)
+    game.checkpoint()
+
+def merge_delta(header : dict, changed_objects : dict, delta : dict):
+    # the same as Game.apply_delta, but on saved data, so deltas can be compacted without building a world.
+    # changed_objects collects id -> latest object data, or None if it was removed
+    for obj_id in delta["removed"]:
+        changed_objects[obj_id] = None
+    for obj in delta["objects"]:
+        changed_objects[obj["id"]] = obj
+
+    removed_or_changed = set(delta["removed"]) | set(delta["listeners"])
+    listeners = dict(
+        (ev, [ listener for listener in ev_listeners if listener["listener"] not in removed_or_changed ])
+        for ev, ev_listeners in header["listeners"].items()
+    )
+    for listener, subscriptions in delta["listeners"].items():
+        for subscription in subscriptions:
+            listeners.setdefault(subscription["event"], []).append({ "listener": listener, "script": subscription["script"] })
+    header["listeners"] = dict( (ev, ev_listeners) for ev, ev_listeners in listeners.items() if len(ev_listeners) > 0 )
+
+    timers = dict( (timer["id"], timer) for timer in header.get("timers", []) )
+    for timer_id in delta["cancelled"]:
+        timers.pop(timer_id, None)
+    for timer in delta["timers"]:
+        timers[timer["id"]] = timer
+    # remaining delays in older saves are relative to the time they were written
+    for timer in timers.values():
+        if "due" not in timer:
+            timer["due"] = header.get("game_time", 0.0) + timer.pop("delay")
+    header["timers"] = sorted(timers.values(), key=lambda t : t["due"])
+
+    for key in ("game_time", "tick_number", "log_seq", "id_namespace", "next_id"):
+        if key in delta:
+            header[key] = delta[key]
+
+def merge_objects(objects : Iterable[dict], changed_objects : dict) -> Iterator[dict]:
+    for obj in objects:
+        if obj["id"] not in changed_objects:
+            yield obj
+            continue
+        changed = changed_objects.pop(obj["id"])
+        if changed != None:
+            yield changed
+    for changed in changed_objects.values():
+        if changed != None:
+            yield changed
+
+def game_state_compact(file : str):
+    # folds the incremental saves into the full save, streaming the objects through
+    if not os.path.exists(delta_file(file)):
+        return
+
+    changed_objects = dict()
+    if is_binary_snapshot(file):
+        snapshot = BinarySnapshot(file)
+        header = snapshot.header()
+        for delta in read_deltas(file):
+            merge_delta(header, changed_objects, delta)
+        objects = ( snapshot.load(obj_id) for obj_id in snapshot.iter_ids() )
+        write_binary_snapshot(file, header, merge_objects(objects, changed_objects))
+        snapshot.close()
+    else:
+        with open(file, mode="r", encoding="utf-8") as f:
+            header, objects = read_snapshot(f)
+            for delta in read_deltas(file):
+                merge_delta(header, changed_objects, delta)
+            write_snapshot(file, header, merge_objects(objects, changed_objects))
 
-def game_state_save(game : Game, file : str):
-    print(game.dump_state())
-    with open(file, mode="w") as f:
-        json.dump(game.dump_state(), f, indent=4)
\ No newline at end of file
+    os.remove(delta_file(file))
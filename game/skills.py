@@ -1,11 +1,20 @@
 from magic_rpg import Game, GameObject, Skill
 from interfaces.magic_io import RichText, COLOR
 from game.utilities import get_in_location, create_object, get_target
+from profiling import Profiler, SamplingProfiler, MIN_SAMPLE_INTERVAL
+import os
+import time
+
+METRICS_DIR = "metrics" # everything profile writes goes in here, under a name without any directories
+PROFILE_FILE = "metrics.prom" # where "profile dump" writes to by default
+SAMPLE_FILE = "profile.collapsed" # where "profile sample stop" writes to by default, a .json name gives a chrome trace
 
 def send_state(game : "Game", caller_id : str, target_id : str):
     game.interface.send_to(caller_id, RichText("STATE", color=COLOR.YELLOW))
     target = game.get_by_id(target_id)
-    for key, value in target.states.items():
+    if target.prototype != None:
+        game.interface.send_to(caller_id, [RichText("prototype", color=COLOR.GREEN), f" | {target.prototype}"])
+    for key, value in target.all_states().items():
         out = [
             RichText(key, color=COLOR.GREEN),
             f" | {str(value)}"
@@ -17,7 +26,7 @@ def send_reactions(game : "Game", caller_id : str, target_id : str):
 
     reactions = []
 
-    for reaction_id in target.reactions:
+    for reaction_id in game.reaction_ids_of(target):
         reaction = game.reactions.get(reaction_id)
         reactions.append(reaction.name)
     
@@ -33,7 +42,7 @@ def send_skills(game : "Game", caller_id : str, target_id : str):
 
     skills = []
 
-    for skill_id in target.skills:
+    for skill_id in game.skill_ids_of(target):
         skill = game.skills.get(skill_id)
         skills.append(skill.name)
     
@@ -49,7 +58,7 @@ def skill_look(game : "Game", args, skill_id, caller_id): # that info can kind o
     location = game.get_by_id(caller.states["location"])
     same_location = get_in_location(game, location.id)
     location_data = game.react_to(caller.id, skill_id, location.id) # caller optional
-    object_datas = [ game.react_to(caller.id, skill_id, y.id) for y in same_location ]
+    object_datas = game.react_to_many(caller.id, skill_id, [ y.id for y in same_location ])
     
     if len(args) > 1:
         for obj in object_datas:
@@ -71,7 +80,7 @@ def skill_inspect(game : "Game", args, skill_id, caller_id):
         game.interface.send_to(caller_id,"inspect ID")
         return
 
-    obj = game.game_objects.get(args[1])
+    obj = game.get_by_id(args[1])
     if obj == None:
         game.interface.send_to(caller_id, RichText(f"Couldn't find object with id {args[1]}.", color=COLOR.RED, bold=True))
         return
@@ -95,7 +104,7 @@ def skill_create(game : "Game", args, skill_id, caller_id):
     
     generic_look : str = game.get_reactions("look")[0] # need a better unique identifier for things like this
 
-    new_obj.reactions.add(generic_look)
+    game.imbue_reaction(new_obj, game.reactions.get(generic_look).name)
 
 def skill_destroy(game: "Game", args, skill_id, caller_id):
     if len(args) < 2:
@@ -136,7 +145,7 @@ def skill_unset(game : "Game", args, skill_id, caller_id):
         game.interface.send_to(caller_id, RichText(f"Couldn't find object with id {args[1]}.", color=COLOR.RED, bold=True))    
         return
 
-    if args[2] not in target.states:
+    if args[2] not in target.states.keys():
         game.interface.send_to(caller_id, RichText(f"Object {args[1]} has no state property {args[2]}", color=COLOR.RED, bold=True))    
         return
 
@@ -155,7 +164,7 @@ def skill_list(game : "Game", args, skill_id, caller_id):
         output = RichText(", ".join([reaction.name for reaction in game.reactions.values()]), color=COLOR.GREEN)
         game.interface.send_to(caller_id, output)
     elif args[1] == "objects":
-        for object in game.game_objects.values():
+        for object in game.all_objects():
             output = [
                 RichText(f"{object.id}", color=COLOR.GREEN),
                 f" | {object.states.get('name')}"
@@ -167,7 +176,7 @@ def skill_imbue(game : "Game", args, skill_id, caller_id):
         game.interface.send_to(caller_id, "imbue [reaction | skill] TARGET_ID NAME")
         return
 
-    target = game.game_objects.get(args[2])
+    target = game.get_by_id(args[2])
     
     if target == None:
         game.interface.send_to(caller_id, RichText(f"Couldn't find object with id {args[1]}.", color=COLOR.RED, bold=True))    
@@ -188,6 +197,166 @@ def skill_imbue(game : "Game", args, skill_id, caller_id):
     
     game.interface.send_to(caller_id, RichText(f"Successfully imbued {target.id} with {args[1]} {args[3]}.", color=COLOR.GREEN))
 
+def send_tick_stats(game : "Game", caller_id : str):
+    stats = game.tick_stats
+    ticks = max(stats.ticks, 1)
+    game.interface.send_to(caller_id, RichText(f"TICKS ({game.scheduler}, {game.overrun_policy})", color=COLOR.YELLOW, underline=True))
+    rows = [
+        ("tick time", f"{game.tick_time * 1000:.1f} ms"),
+        ("game time", f"{game.game_time:.2f} s"),
+        ("ticks", f"{stats.ticks} run, {stats.skipped} skipped, {stats.overruns} overran"),
+        ("work", f"{stats.last_work * 1000:.2f} ms last, {stats.total_work / ticks * 1000:.2f} ms mean, {stats.max_work * 1000:.2f} ms max"),
+        ("lateness", f"{stats.last_lateness * 1000:.2f} ms last, {stats.total_lateness / ticks * 1000:.2f} ms mean, {stats.max_lateness * 1000:.2f} ms max")
+    ]
+    for key, value in rows:
+        game.interface.send_to(caller_id, [RichText(key, color=COLOR.GREEN), f" | {value}"])
+
+def send_input_stats(game : "Game", caller_id : str):
+    stats = game.interface.input_stats
+    game.interface.send_to(caller_id, RichText("INPUT", color=COLOR.YELLOW, underline=True))
+    rows = [
+        ("budget", f"{game.interface.user_budget} per user, {game.interface.tick_budget} per tick"),
+        ("commands", f"{stats.received} received, {stats.ran} run, {stats.dropped} dropped"),
+        ("last tick", f"{stats.last_ran} run, {stats.pending} still queued")
+    ]
+    for key, value in rows:
+        game.interface.send_to(caller_id, [RichText(key, color=COLOR.GREEN), f" | {value}"])
+
+def send_save_stats(game : "Game", caller_id : str):
+    if game.autosave == None:
+        game.interface.send_to(caller_id, "Autosave is off.")
+        return
+    stats = game.autosave.stats
+    game.interface.send_to(caller_id, RichText(f"AUTOSAVE ({game.autosave.method})", color=COLOR.YELLOW, underline=True))
+    rows = [
+        ("interval", f"{game.autosave.interval:.0f} s"),
+        ("saves", f"{stats.saves} written, {stats.failures} failed" + (", one in progress" if game.autosave.in_progress() else "")),
+        ("pause", f"{stats.last_pause * 1000:.2f} ms last, {stats.total_pause / max(stats.captures, 1) * 1000:.2f} ms mean, {stats.max_pause * 1000:.2f} ms max"),
+        ("duration", f"{stats.last_duration:.2f} s last")
+    ]
+    for key, value in rows:
+        game.interface.send_to(caller_id, [RichText(key, color=COLOR.GREEN), f" | {value}"])
+
+def send_output_stats(game : "Game", caller_id : str, count : int = 5):
+    totals = game.interface.output_totals
+    game.interface.send_to(caller_id, RichText("OUTPUT", color=COLOR.YELLOW, underline=True))
+    rows = [
+        ("queued", f"{totals.queued_messages} messages, {totals.queued_bytes / 1024:.1f} KiB over {len(game.interface.output_stats)} clients"),
+        ("sent", f"{totals.sent_messages} messages, {totals.sent_bytes / 1024:.1f} KiB"),
+        ("dropped", f"{totals.dropped_messages} messages, {totals.summaries} summaries, {totals.disconnects} disconnects")
+    ]
+    # the clients furthest behind
+    deepest = sorted(game.interface.output_stats.items(), key=lambda item : item[1].queued_bytes, reverse=True)[:count]
+    for user, stats in deepest:
+        rows.append((user, f"{stats.queued_messages} messages, {stats.queued_bytes / 1024:.1f} KiB queued, {stats.dropped_messages} dropped"))
+    for key, value in rows:
+        game.interface.send_to(caller_id, [RichText(key, color=COLOR.GREEN), f" | {value}"])
+
+def skill_stats(game : "Game", args, skill_id, caller_id):
+    if len(args) < 2 or args[1] not in {"tick", "input", "save", "output"}:
+        game.interface.send_to(caller_id, "stats [tick | input | save | output]")
+        return
+
+    if args[1] == "tick":
+        send_tick_stats(game, caller_id)
+    elif args[1] == "input":
+        send_input_stats(game, caller_id)
+    elif args[1] == "save":
+        send_save_stats(game, caller_id)
+    elif args[1] == "output":
+        send_output_stats(game, caller_id)
+
+def send_profile(game : "Game", caller_id : str, count : int):
+    game.interface.send_to(caller_id, RichText(f"CALLBACKS (since {time.strftime('%H:%M:%S', time.localtime(game.profiler.started))})", color=COLOR.YELLOW, underline=True))
+    for kind, name, histogram in game.profiler.top(count):
+        game.interface.send_to(caller_id, [
+            RichText(f"{kind} {name}", color=COLOR.GREEN),
+            f" | {histogram.count} calls, {histogram.total * 1000:.1f} ms total, {histogram.total / histogram.count * 1000:.3f} ms mean,"
+            f" p99 <= {histogram.quantile(0.99) * 1000:.2f} ms, {histogram.max * 1000:.2f} ms max"
+        ])
+
+def profile_sample(game : "Game", args, caller_id):
+    if len(args) < 3 or args[2] not in {"start", "stop", "status"}:
+        game.interface.send_to(caller_id, "profile sample [start [INTERVAL_MS] [signal | thread] | stop [FILE] | status]")
+        return
+
+    if args[2] == "start":
+        if game.sampler != None and game.sampler.running():
+            game.interface.send_to(caller_id, "Already sampling.")
+            return
+        try:
+            interval = float(args[3]) / 1000 if len(args) > 3 else 0.005
+            game.sampler = SamplingProfiler(interval, args[4] if len(args) > 4 else None)
+        except ValueError:
+            game.interface.send_to(caller_id, f"profile sample start [INTERVAL_MS] [signal | thread], at least {MIN_SAMPLE_INTERVAL * 1000:g} ms")
+            return
+        game.sampler.start()
+        game.interface.send_to(caller_id, f"Sampling every {interval * 1000:.1f} ms ({game.sampler.mode}).")
+    elif game.sampler == None:
+        game.interface.send_to(caller_id, "Not sampling.")
+    elif args[2] == "status":
+        state = "running" if game.sampler.running() else "stopped"
+        game.interface.send_to(caller_id, f"Sampler {state}, {len(game.sampler.samples)} samples, {game.sampler.dropped} dropped.")
+    elif args[2] == "stop":
+        file = metrics_path(args[3] if len(args) > 3 else SAMPLE_FILE)
+        if file == None:
+            game.interface.send_to(caller_id, "profile sample stop [FILE]")
+            return
+        game.sampler.stop()
+        game.sampler.write(file)
+        game.interface.send_to(caller_id, RichText(f"Wrote {len(game.sampler.samples)} samples to {file}.", color=COLOR.GREEN))
+        game.sampler = None
+
+def metrics_path(name : str) -> str:
+    # players only get to pick a file name, never where it goes
+    name = os.path.basename(name)
+    if name in {"", ".", ".."}:
+        return None
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    return os.path.join(METRICS_DIR, name)
+
+def skill_profile(game : "Game", args, skill_id, caller_id):
+    caller : GameObject = game.get_by_id(caller_id)
+    if caller == None or caller.states.get("admin") != True:
+        game.interface.send_to(caller_id, "Only admins can profile the server.")
+        return
+
+    if len(args) < 2 or args[1] not in {"on", "off", "reset", "show", "dump", "sample"}:
+        game.interface.send_to(caller_id, "profile [on | off | reset | show [COUNT] | dump [FILE] | sample ...]")
+        return
+
+    if args[1] == "sample":
+        profile_sample(game, args, caller_id)
+        return
+
+    if args[1] == "on":
+        if game.profiler == None:
+            game.profiler = Profiler()
+        game.interface.send_to(caller_id, "Profiling callbacks.")
+        return
+    if game.profiler == None:
+        game.interface.send_to(caller_id, "Profiling is off.")
+        return
+
+    if args[1] == "off":
+        game.profiler = None
+        game.interface.send_to(caller_id, "Stopped profiling callbacks.")
+    elif args[1] == "reset":
+        game.profiler.reset()
+        game.interface.send_to(caller_id, "Reset callback metrics.")
+    elif args[1] == "show":
+        if len(args) > 2 and not args[2].isdigit():
+            game.interface.send_to(caller_id, "profile show [COUNT]")
+            return
+        send_profile(game, caller_id, int(args[2]) if len(args) > 2 else 10)
+    elif args[1] == "dump":
+        file = metrics_path(args[2] if len(args) > 2 else PROFILE_FILE)
+        if file == None:
+            game.interface.send_to(caller_id, "profile dump [FILE]")
+            return
+        game.profiler.write_prometheus(file)
+        game.interface.send_to(caller_id, RichText(f"Wrote callback metrics to {file}.", color=COLOR.GREEN))
+
 def skill_go(game : "Game", args, skill_id, caller_id):
     if len(args) < 2:
         game.interface.send_to(caller_id,"go EXIT")
@@ -230,8 +399,9 @@ def skill_say(game: "Game", args, skill_id, caller_id):
     caller : GameObject = game.get_by_id(caller_id)
     listeners : list[GameObject] = get_in_location(game, caller.states["location"])
 
-    for listener in listeners:
-        game.react_to(caller_id, skill_id, listener.id, {"words": args[1]})
+    # one line shared by every listener, so it's only encoded once however many hear it
+    line = [RichText(caller.states.get("name") + ": ", COLOR.YELLOW), args[1]]
+    game.react_to_many(caller_id, skill_id, [ listener.id for listener in listeners ], {"words": args[1], "line": line})
 
 SKILLS = {
     Skill("look", on_parsed=skill_look),
@@ -243,5 +413,7 @@ SKILLS = {
     Skill("set", on_parsed=skill_set),
     Skill("unset", on_parsed=skill_unset),
     Skill("list", on_parsed=skill_list),
-    Skill("imbue", on_parsed=skill_imbue)
+    Skill("imbue", on_parsed=skill_imbue),
+    Skill("stats", on_parsed=skill_stats),
+    Skill("profile", on_parsed=skill_profile)
 }
\ No newline at end of file
@@ -1,7 +1,7 @@
 from magic_rpg import Game, GameObject
 
 def create_object(game : Game, name: str, description: str, location: str = None, id = None):
-    new_obj = GameObject(id)
+    new_obj = GameObject(id if id != None else game.new_id())
     new_obj.states["name"] = name
     new_obj.states["description"] = description
     if location != None:
@@ -9,14 +9,24 @@ def create_object(game : Game, name: str, description: str, location: str = None
     game.add_object(new_obj)
     return new_obj
 
+def create_instance(game : Game, prototype_id : str, location: str = None, id = None, **states):
+    # a copy of the prototype which only stores what's given here, everything else is looked up on the prototype
+    new_obj = GameObject(id if id != None else game.new_id())
+    new_obj.prototype = prototype_id
+    new_obj.states = states
+    if location != None:
+        new_obj.states["location"] = location
+    game.add_object(new_obj)
+    return new_obj
+
 def get_in_location(game : Game, location_id):
-    return game.get_by_state("location", lambda loc : loc == location_id)
+    return game.get_in_location(location_id)
 
 def get_visible(game : Game, caller_id):
     caller : GameObject = game.get_by_id(caller_id)
     location = game.get_by_id(caller.states["location"])
     same_location = get_in_location(game, caller.states.get("location"))
-    return [ game.react_to(caller.id, game.get_skill_id("look"), y.id) for y in same_location ]
+    return game.react_to_many(caller.id, game.get_skill_id("look"), [ y.id for y in same_location ])
 
 def get_target(game : Game, caller_id, target_name):
     target = None
@@ -1,10 +1,11 @@
 from dataclasses import dataclass
 from typing import Callable, Union
+from collections import deque
 from interfaces.magic_io import RichText
+import traceback
 import uuid
-import asyncio
 
-# use of create_task is abusive but justified for brevity
+# output is collected per user over a tick and handed to output_stream in one go when the game calls flush
 
 # @dataclass
 # class InputInterface:
@@ -19,12 +20,36 @@ import asyncio
 #     update : Callable[[str, GameObject]]
 #     # join the user to their id and call the update function when requested
 
+@dataclass
+class InputStats:
+    received : int = 0
+    dropped : int = 0 # commands refused because the user's queue was full
+    ran : int = 0
+    last_ran : int = 0 # commands run in the last poll
+    pending : int = 0
+
+@dataclass
+class OutputStats:
+    # kept up to date by whatever writes to the client (see server.Connection), one per client plus a total
+    queued_messages : int = 0
+    queued_bytes : int = 0
+    sent_messages : int = 0
+    sent_bytes : int = 0
+    dropped_messages : int = 0 # thrown away because the client fell too far behind
+    summaries : int = 0 # "you missed N lines" sent in place of dropped output
+    disconnects : int = 0 # clients dropped for falling behind
+
 class NetIO():
     def __init__(
         self, 
         input_stream : Callable[[str, uuid.UUID], None], 
-        output_stream : Callable[[str,Union[list, RichText, str]], None],
-        user_updater : Callable[[str, dict], None]
+        output_stream : Callable[[str, list[Union[list, RichText, str]]], None],
+        user_updater : Callable[[str, dict], None],
+        user_budget : int = 4,
+        tick_budget : int = 256,
+        max_queued : int = 64,
+        encoders : dict[str, Callable[[Union[list, RichText, str]], Union[str, bytes]]] = None,
+        default_protocol : str = "json"
     ):
         
         # join object ID to username
@@ -35,24 +60,105 @@ class NetIO():
         # call parse on these
         self.input_stream = input_stream
         self.user_updater = user_updater
-
+        # commands wait here until the game polls for them once per tick, so the world is only changed from the tick loop
+        self.input_queues : dict[str, deque[str]] = dict()
+        self._ready : deque[str] = deque() # users with queued commands, in round robin order
+        self.user_budget = user_budget # most commands run for one user in one tick
+        self.tick_budget = tick_budget # most commands run for everybody in one tick
+        self.max_queued = max_queued
+        self.input_stats = InputStats()
+        self.outbox : dict[str, list] = dict() # output for each user since the last flush
+        # if set, output_stream gets messages encoded for the user's protocol, each message only encoded once per flush
+        # and protocol
+        self.encoders = encoders
+        self.protocols : dict[str, str] = dict() # by user, for users not on default_protocol
+        self.default_protocol : str = default_protocol
+        self.output_stats : dict[str, OutputStats] = dict() # by user, for connected users
+        self.output_totals : OutputStats = OutputStats()
 
     def send_to(self, id, msg):
-        if id not in self.id_to_user:
-            return        
         username = self.id_to_user.get(id)
-        asyncio.create_task(self.output_stream(username, msg))
+        if username == None:
+            return
+        self.outbox.setdefault(username, []).append(msg)
 
     def broadcast(self, msg):
-        for user in set(self.id_to_user.values()):
-            # prevents same user being called twice
-            asyncio.create_task(self.output_stream(user, msg))
+        for user in self.user_to_id:
+            self.outbox.setdefault(user, []).append(msg)
+
+    def flush(self):
+        # called by the game at the end of every tick
+        outbox = self.outbox
+        self.outbox = dict()
+        if self.encoders == None:
+            for user, msgs in outbox.items():
+                self.output_stream(user, msgs)
+            return
+
+        # keyed by id, which is safe because the outbox keeps every message alive until we're done
+        encoded : dict[tuple[str, int], Union[str, bytes]] = dict()
+        for user, msgs in outbox.items():
+            protocol = self.protocols.get(user, self.default_protocol)
+            encoder = self.encoders[protocol]
+            parts = []
+            for msg in msgs:
+                part = encoded.get((protocol, id(msg)))
+                if part == None:
+                    try:
+                        part = encoded[(protocol, id(msg))] = encoder(msg)
+                    except Exception:
+                        # one bad message shouldn't cost everybody else their output, or stop the tick
+                        traceback.print_exc()
+                        continue
+                parts.append(part)
+            if len(parts) > 0:
+                self.output_stream(user, parts)
     
     async def parse(self, input, user):
         if user not in self.user_to_id:
             return
 
-        self.input_stream(input, self.user_to_id.get(user))
+        queue = self.input_queues.setdefault(user, deque())
+        if len(queue) >= self.max_queued:
+            self.input_stats.dropped += 1
+            self.send_to(self.user_to_id.get(user), "You're sending commands too quickly; that one was ignored.")
+            return
+        if len(queue) == 0:
+            self._ready.append(user)
+        queue.append(input)
+        self.input_stats.received += 1
+        self.input_stats.pending += 1
+
+    def poll(self):
+        # called by the game once per tick
+        ran = 0
+        for _ in range(len(self._ready)):
+            if ran >= self.tick_budget:
+                break
+            user = self._ready.popleft()
+            queue = self.input_queues.get(user)
+            user_ran = 0
+            while len(queue) > 0 and user_ran < self.user_budget and ran < self.tick_budget:
+                raw = queue.popleft()
+                user_ran += 1
+                ran += 1
+                id = self.user_to_id.get(user)
+                if id == None:
+                    break
+                try:
+                    self.input_stream(raw, id)
+                except Exception:
+                    # one bad command shouldn't take the tick loop down with it
+                    traceback.print_exc()
+            if user in self.user_to_id and len(queue) > 0:
+                self._ready.append(user)
+
+        self.input_stats.ran += ran
+        self.input_stats.last_ran = ran
+        self.input_stats.pending -= ran
+
+    def is_user(self, id) -> bool:
+        return id in self.id_to_user
 
     def update_user(self, data : dict):
         username : str = self.id_to_user.get(data.get("id"))
@@ -63,12 +169,23 @@ class NetIO():
         self.id_to_user[id] = user
         self.user_to_id[user] = id
 
+    def _drop_input(self, user):
+        self.outbox.pop(user, None)
+        queue = self.input_queues.pop(user, None)
+        if queue == None:
+            return
+        self.input_stats.pending -= len(queue)
+        if user in self._ready:
+            self._ready.remove(user)
+
     def remove_user(self, user):
         id = self.user_to_id[user]
         del self.id_to_user[id]
         del self.user_to_id[user]
+        self._drop_input(user)
 
     def remove_id(self, id):
         user = self.id_to_user[id]
         del self.user_to_id[user]
-        del self.id_to_user[id]
\ No newline at end of file
+        del self.id_to_user[id]
+        self._drop_input(user)
\ No newline at end of file
@@ -0,0 +1,214 @@
+from dataclasses import dataclass, fields, MISSING
+from json.encoder import encode_basestring_ascii
+from operator import attrgetter
+from typing import Callable, Union
+from interfaces.magic_io import RichText
+
+# what the server sends to clients. a frame is {"type": "output", "data": OUTPUT} for a single message or
+# {"type": "batch", "data": [OUTPUT, ...]} for everything one user got in a tick, where OUTPUT is
+#   {"type": "PlainText", "content": "text"}
+#   {"type": "RichText", "content": {"text": "text", "color": 3, "bold": true}}   style fields left at their default are left out
+#   {"type": "List", "content": [OUTPUT, ...]}
+# messages are encoded on their own and frames put together from the encoded parts, so a message going to many users is
+# only encoded once. the json is written directly rather than through dataclasses, in the layout json.dumps uses.
+#
+# clients can ask for the binary protocol instead when they connect ("protocol": ["binary", "json"], in order of
+# preference). it carries the same frames, sent as binary websocket messages so the client can tell which it got:
+#   frame   byte 0 output, then one item | byte 1 batch, then varint count and the items | byte 2 disconnect
+#   item    byte 0 PlainText, then a string
+#           byte 1 RichText, then a varint saying which style fields are set, bit i for RICH_TEXT_STYLE[i], the varint
+#                  values of the set fields which aren't bools, in that order, and then the text
+#           byte 2 List, then varint count and the items
+#   string  varint length, then utf-8
+#           byte 3 null
+# varints are unsigned LEB128.
+#
+# both are total, so nothing a reaction sends can stop a tick: None, and RichText whose text isn't a string, go out as
+# null (which the client skips), anything else that isn't a message as its str(), and style values which should be ints
+# but aren't ints of at least 0 are left out.
+
+DISCONNECT_FRAME = '{"type": "disconnect", "data": null}'
+
+# (field, default, whether it's a bool) for every style field of RichText
+RICH_TEXT_STYLE = tuple( (f.name, f.default, f.type == bool) for f in fields(RichText) if f.default is not MISSING )
+
+def encode_rich_text(text : RichText) -> str:
+    if not isinstance(text.text, str):
+        return "null"
+    out = '{"type": "RichText", "content": {"text": ' + encode_basestring_ascii(text.text)
+    for name, default, is_bool in RICH_TEXT_STYLE:
+        value = getattr(text, name)
+        if is_bool:
+            if bool(value) != default:
+                out += ', "' + name + '": ' + ("true" if value else "false")
+        elif value != default and isinstance(value, int) and value >= 0:
+            out += ', "' + name + '": ' + "%d" % value
+    return out + '}}'
+
+def encode_message(msg) -> str:
+    if isinstance(msg, str):
+        return '{"type": "PlainText", "content": ' + encode_basestring_ascii(msg) + '}'
+    elif isinstance(msg, RichText):
+        return encode_rich_text(msg)
+    elif isinstance(msg, list):
+        return '{"type": "List", "content": [' + ", ".join([ encode_message(item) for item in msg ]) + ']}'
+    elif msg == None:
+        return "null"
+    return encode_message(str(msg))
+
+def frame_from_parts(parts : list[str]) -> str:
+    if len(parts) == 1:
+        return '{"type": "output", "data": ' + parts[0] + '}'
+    return '{"type": "batch", "data": [' + ", ".join(parts) + ']}'
+
+def encode_output(msgs : list) -> str:
+    return frame_from_parts([ encode_message(msg) for msg in msgs ])
+
+OUTPUT, BATCH, DISCONNECT = 0, 1, 2
+PLAIN_TEXT, RICH_TEXT, LIST, NULL = 0, 1, 2, 3
+
+def encode_varint(value : int) -> bytes:
+    if 0 <= value < 0x80:
+        return SMALL_VARINTS[value]
+    if value < 0:
+        raise ValueError(f"Can't encode negative number {value}.")
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+SMALL_VARINTS = tuple( bytes((value,)) for value in range(0x80) )
+
+def encode_string(text : str) -> bytes:
+    data = text.encode("utf-8")
+    length = len(data)
+    return (SMALL_VARINTS[length] if length < 0x80 else encode_varint(length)) + data
+
+# the tag and style mask of a RichText, by (color, standout, ...), filled in as styles turn up. there are only so many
+# styles in use, so most RichText is one dict lookup and a string
+RICH_TEXT_HEADERS : dict[tuple, bytes] = dict()
+rich_text_style = attrgetter(*[ name for name, _, _ in RICH_TEXT_STYLE ])
+
+def rich_text_header(style : tuple) -> bytes:
+    mask = 0
+    values = b""
+    for i, ((name, default, is_bool), value) in enumerate(zip(RICH_TEXT_STYLE, style)):
+        if is_bool and bool(value) != default:
+            mask |= 1 << i
+        elif not is_bool and value != default and isinstance(value, int) and value >= 0:
+            mask |= 1 << i
+            values += encode_varint(value)
+    return bytes((RICH_TEXT,)) + encode_varint(mask) + values
+
+def encode_rich_text_binary(text : RichText) -> bytes:
+    if not isinstance(text.text, str):
+        return NULL_TAG
+    style = rich_text_style(text)
+    try:
+        header = RICH_TEXT_HEADERS.get(style)
+        if header == None:
+            header = RICH_TEXT_HEADERS[style] = rich_text_header(style)
+    except TypeError:
+        # a style value that can't be hashed, which is left out anyway
+        header = rich_text_header(style)
+    return header + encode_string(text.text)
+
+PLAIN_TEXT_TAG = bytes((PLAIN_TEXT,))
+LIST_TAG = bytes((LIST,))
+NULL_TAG = bytes((NULL,))
+
+def encode_message_binary(msg) -> bytes:
+    if isinstance(msg, str):
+        return PLAIN_TEXT_TAG + encode_string(msg)
+    elif isinstance(msg, RichText):
+        return encode_rich_text_binary(msg)
+    elif isinstance(msg, list):
+        return LIST_TAG + encode_varint(len(msg)) + b"".join([ encode_message_binary(item) for item in msg ])
+    elif msg == None:
+        return NULL_TAG
+    return encode_message_binary(str(msg))
+
+def frame_from_parts_binary(parts : list[bytes]) -> bytes:
+    if len(parts) == 1:
+        return bytes((OUTPUT,)) + parts[0]
+    return bytes((BATCH,)) + encode_varint(len(parts)) + b"".join(parts)
+
+class BinaryReader:
+    # turns a binary frame back into what json.loads gives for the same frame, so the client handles both the same way
+    def __init__(self, data : bytes):
+        self.data : bytes = data
+        self.pos : int = 0
+
+    def byte(self) -> int:
+        value = self.data[self.pos]
+        self.pos += 1
+        return value
+
+    def varint(self) -> int:
+        value, shift = 0, 0
+        while True:
+            byte = self.byte()
+            value |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return value
+            shift += 7
+
+    def string(self) -> str:
+        length = self.varint()
+        text = self.data[self.pos:self.pos + length].decode("utf-8")
+        self.pos += length
+        return text
+
+    def item(self) -> dict:
+        tag = self.byte()
+        if tag == PLAIN_TEXT:
+            return { "type": "PlainText", "content": self.string() }
+        elif tag == RICH_TEXT:
+            mask = self.varint()
+            content = dict()
+            for i, (name, default, is_bool) in enumerate(RICH_TEXT_STYLE):
+                if mask & (1 << i):
+                    content[name] = (not default) if is_bool else self.varint()
+            return { "type": "RichText", "content": { "text": self.string(), **content } }
+        elif tag == LIST:
+            return { "type": "List", "content": [ self.item() for _ in range(self.varint()) ] }
+        elif tag == NULL:
+            return None
+        raise ValueError(f"Unknown item type {tag}.")
+
+    def frame(self) -> dict:
+        frame_type = self.byte()
+        if frame_type == OUTPUT:
+            return { "type": "output", "data": self.item() }
+        elif frame_type == BATCH:
+            return { "type": "batch", "data": [ self.item() for _ in range(self.varint()) ] }
+        elif frame_type == DISCONNECT:
+            return { "type": "disconnect", "data": None }
+        raise ValueError(f"Unknown frame type {frame_type}.")
+
+def decode_binary_frame(data : bytes) -> dict:
+    return BinaryReader(data).frame()
+
+@dataclass
+class Protocol:
+    name : str
+    encode_message : Callable[[Union[list, RichText, str]], Union[str, bytes]]
+    frame_from_parts : Callable[[list], Union[str, bytes]]
+    disconnect_frame : Union[str, bytes]
+
+    def encode_output(self, msgs : list) -> Union[str, bytes]:
+        return self.frame_from_parts([ self.encode_message(msg) for msg in msgs ])
+
+JSON = Protocol("json", encode_message, frame_from_parts, DISCONNECT_FRAME)
+BINARY = Protocol("binary", encode_message_binary, frame_from_parts_binary, bytes((DISCONNECT,)))
+PROTOCOLS = { protocol.name: protocol for protocol in (JSON, BINARY) }
+
+def choose_protocol(offered, allowed) -> Protocol:
+    # the first one the client offered that we allow, json for clients which don't say
+    if isinstance(offered, list):
+        for name in offered:
+            if name in allowed and name in PROTOCOLS:
+                return PROTOCOLS[name]
+    return JSON
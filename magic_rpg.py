@@ -1,18 +1,26 @@
 from dataclasses import dataclass, asdict
 import uuid
-from objects import GameObject, Reaction, Skill
-from typing import Callable, Iterable, Union, Any
+from objects import GameObject, Reaction, Skill, MISSING
+from typing import Callable, Iterable, Iterator, Union, Any
 from curses import wrapper
 from interfaces.CursesIO import CursesIO
 from interfaces.NetIO import NetIO
 from interfaces.magic_io import RichText, COLOR
 from copy import deepcopy
+import tokenizer
+import traceback
+from command_log import CommandLog
+from binary_snapshot import BinarySnapshot
+from registry import Registry, stable_id
+from profiling import Profiler, SamplingProfiler
 from enum import IntEnum
 import time
 import asyncio
+import heapq
 
 class Script:
     def __init__(self, name : str, callback : Callable[["Game", str, "EventData"], str]):
+        self.id : str = stable_id("script", name)
         self.name : str = name
         self.callback : Callable[[Game, str, "EventData"], str] = callback
 
@@ -28,6 +36,43 @@ class EventData:
 class EventDataOnTick(EventData):
     cur_time : float
 
+@dataclass
+class EventDataOnTimer(EventData):
+    cur_time : float
+    timer_id : str
+    data : Any
+
+@dataclass
+class Timer:
+    id : str
+    due : float # game time at which the script runs
+    listener : str
+    script : str
+    data : Any = None
+
+@dataclass
+class TickStats:
+    ticks : int = 0
+    skipped : int = 0 # ticks dropped by the overrun policy
+    overruns : int = 0 # ticks which finished after the next tick was due
+    last_work : float = 0.0
+    max_work : float = 0.0
+    total_work : float = 0.0
+    last_lateness : float = 0.0
+    max_lateness : float = 0.0
+    total_lateness : float = 0.0
+
+    def record_work(self, seconds : float):
+        self.ticks += 1
+        self.last_work = seconds
+        self.max_work = max(self.max_work, seconds)
+        self.total_work += seconds
+
+    def record_lateness(self, seconds : float):
+        self.last_lateness = seconds
+        self.max_lateness = max(self.max_lateness, seconds)
+        self.total_lateness += seconds
+
 def help(game : "Game", user : uuid.UUID):
     game.interface.send_to(user, "HELP")
     for cmd in Game._default_commands:
@@ -43,12 +88,12 @@ def exit_game(game : "Game"):
     game.exit = True
 
 def show_skills(game : "Game", user):
-    player : GameObject = game.game_objects[user]
+    player : GameObject = game.get_by_id(user)
     # tbl = Table(title="Skills")
     # tbl.add_column("Skill", justify="center", style="bright_cyan")
     # tbl.add_column("Description", justify="center")
     game.interface.send_to(user, "SKILLS")
-    for skill_id in player.skills:
+    for skill_id in game.skill_ids_of(player):
         skill : Skill = game.skills.get(skill_id)
         game.interface.send_to(user, f"{skill.name} | {skill.description}")
     # print(tbl)
@@ -61,99 +106,319 @@ class Game:
 
     _default_commands = {"help": ("See this help message", help), "skills": ("Show your available skills (things you can do).", show_skills)}
 
-    def __init__(self, tick_time = 0.0625):
+    # "fixed" sleeps for tick_time after every tick, "deadline" sleeps only for what is left of the period
+    SCHEDULERS = {"fixed", "deadline"}
+    # what a deadline scheduler does when it falls behind: run the missed ticks back to back (up to max_catch_up), or drop them
+    OVERRUN_POLICIES = {"catch_up", "skip"}
+
+    def __init__(self, tick_time = 0.0625, scheduler = "fixed", overrun_policy = "catch_up", max_catch_up = 4):
+        if scheduler not in Game.SCHEDULERS:
+            raise ValueError(f"Unknown scheduler {scheduler}.")
+        if overrun_policy not in Game.OVERRUN_POLICIES:
+            raise ValueError(f"Unknown overrun policy {overrun_policy}.")
         self.game_objects : dict[str, GameObject] = dict()
-        self.skills : dict[str, Skill] = dict()
-        self.reactions : dict[str, Reaction] = dict()
-        self.scripts : dict[str, Script] = dict()
-        self.listeners : dict[str, list[ListenerData]] = dict()
+        self.skills : Registry[Skill] = Registry("skill")
+        self.reactions : Registry[Reaction] = Registry("reaction", group=lambda reaction : reaction.reacting_to_id)
+        self.scripts : Registry[Script] = Registry("script")
+        self.listeners : dict[str, dict[tuple[str, str], ListenerData]] = dict() # event -> (listener, script) -> subscription
+        self._subscriptions : dict[str, dict[tuple[str, str], ListenerData]] = dict() # listener -> (event, script) -> subscription
         self.before_start : Callable[["Game"], None] = do_nothing
         self._skill_parse_dict : dict[str, str] = dict()
-        self._reaction_parse_dict : dict[str, list[str]] = dict()
+        self._reaction_dispatch : dict[tuple[str, str], Reaction] = dict() # (skill id, object id) -> reaction to run, filled lazily by react_to
         self.on_tick_listeners : set[str] = set()
+        self.location_index : dict[str, dict[str, None]] = dict() # location id -> ids of contained objects (dict used as an ordered set)
+        self.instances : dict[str, set[str]] = dict() # prototype id -> ids of objects using it
+        # with a binary snapshot attached, objects stay in the snapshot until something asks for them
+        self._snapshot : BinarySnapshot = None
+        self._snapshot_removed : set[str] = set()
+        self._snapshot_locations : set[str] = set() # locations whose contents have been read from the snapshot
         self.exit : bool = False
         self.tick_time = tick_time
         self.interface : NetIO = None
         self.game_time = 0.0
+        self.scheduler : str = scheduler
+        self.overrun_policy : str = overrun_policy
+        self.max_catch_up : int = max_catch_up
+        self.tick_stats : TickStats = TickStats()
+        self.autosave = None # set by Autosave, for its stats
+        self.profiler : Profiler = None # callback timings, only collected while one is attached
+        self.sampler : SamplingProfiler = None
+        self._next_deadline : float = None
+        self.timers : dict[str, Timer] = dict()
+        self._timer_heap : list[tuple[float, int, str]] = [] # (due, sequence, timer id), cancelled timers are dropped lazily
+        self._timer_seq : int = 0
+        self._timers_by_listener : dict[str, set[str]] = dict()
+        # what has changed since the last checkpoint, so a save only needs to write that
+        self._dirty_objects : set[str] = set()
+        self._removed_objects : set[str] = set()
+        self._dirty_listeners : set[str] = set()
+        self._dirty_timers : set[str] = set()
+        self.tick_number : int = 0 # ticks run since the world was created, used to tag the command log
+        self.command_log : CommandLog = None
+        self.log_seq : int = 0 # sequence number of the last command log record applied to this world
+        # ids handed out by new_id are derived from a per world namespace and a counter, so that replaying the command log
+        # creates objects with the same ids as the first time round
+        self.id_namespace : str = str(uuid.uuid4())
+        self.next_id : int = 0
 
     def set_interface(self, interface):
         self.interface = interface
 
-    def split_args(raw: str) -> list[str]:
-        i = 0
-        start = 0
-        buffer = ""
-        quoting = False
-        arg_list = []
-        while i < len(raw):
-            buffer += raw[i]
-            if raw[i] == " " and not quoting:
-                arg_list.append(buffer[:-1])
-                start = i+1
-                buffer = ""
-            if raw[i] in "\"\'" and not quoting:
-                quoting = True
-                start = i
-                buffer = ""
-            elif raw[i] in "\"\'" and quoting:
-                quoting = False
-                buffer = buffer[:-1]
-            i += 1
-        if len(buffer) > 0:
-            arg_list.append(buffer)
-        return arg_list
+    split_args = staticmethod(tokenizer.split_args)
 
     def obj_to_dict(self, obj : GameObject):
         reaction_names = []
-        for reaction in obj.reactions:
+        for reaction in obj.reaction_ids():
             reaction_names.append( self.reactions.get(reaction).name )
         skill_names = []
-        for skill in obj.skills:
+        for skill in obj.skill_ids():
             skill_names.append( self.skills.get(skill).name )
-        return {
+        data = {
             "id": obj.id,
-            "state": deepcopy(obj.states),
+            "state": deepcopy(dict(obj.states)),
             "reactions": reaction_names,
             "skills": skill_names
         }
+        if obj.prototype != None:
+            data["prototype"] = obj.prototype
+        return data
 
     def listeners_to_dict(self):
         out = {}
         for ev, listeners in self.listeners.items():
-            out[ev] = [x for x in map( lambda l : asdict(l), listeners )]
+            out[ev] = [x for x in map( lambda l : asdict(l), listeners.values() )]
         return out
 
-    def dump_state(self):
+    def timer_to_dict(self, timer : Timer):
+        return { "id": timer.id, "due": timer.due, "listener": timer.listener, "script": timer.script, "data": deepcopy(timer.data) }
+
+    def timers_to_list(self):
+        return [ self.timer_to_dict(timer) for timer in sorted(self.timers.values(), key=lambda t : t.due) ]
+
+    def clock_to_dict(self):
+        return { "game_time": self.game_time, "tick_number": self.tick_number, "log_seq": self.log_seq, "id_namespace": self.id_namespace, "next_id": self.next_id }
+
+    def clock_from_dict(self, data : dict):
+        self.game_time = data.get("game_time", self.game_time)
+        self.tick_number = data.get("tick_number", self.tick_number)
+        self.log_seq = data.get("log_seq", self.log_seq)
+        self.id_namespace = data.get("id_namespace", self.id_namespace)
+        self.next_id = data.get("next_id", self.next_id)
+
+    def dump_header(self):
+        # everything in a snapshot except the objects
         return {
+            **self.clock_to_dict(),
             "listeners": self.listeners_to_dict(),
-            "objects": [x for x in map( lambda obj : self.obj_to_dict(obj), self.game_objects.values())]
+            "timers": self.timers_to_list()
+        }
+
+    def iter_object_dicts(self) -> Iterator[dict]:
+        for obj in self.all_objects():
+            yield self.obj_to_dict(obj)
+
+    def dump_state(self):
+        return {
+            **self.dump_header(),
+            "objects": list(self.iter_object_dicts())
+        }
+
+    def dump_delta(self):
+        # everything which changed since the last checkpoint, in a form apply_delta understands
+        return {
+            **self.clock_to_dict(),
+            "objects": [ self.obj_to_dict(self.game_objects[obj_id]) for obj_id in self._dirty_objects ],
+            "removed": list(self._removed_objects),
+            "listeners": dict(
+                (listener, [ { "event": event_name, "script": script } for event_name, script in self._subscriptions.get(listener, ()) ])
+                for listener in self._dirty_listeners
+            ),
+            "timers": [ self.timer_to_dict(self.timers[timer_id]) for timer_id in self._dirty_timers if timer_id in self.timers ],
+            "cancelled": [ timer_id for timer_id in self._dirty_timers if timer_id not in self.timers ]
         }
 
-    def obj_from_dict(self, data : dict) -> GameObject:
+    def checkpoint(self):
+        # call once the current state has been saved
+        self._dirty_objects.clear()
+        self._removed_objects.clear()
+        self._dirty_listeners.clear()
+        self._dirty_timers.clear()
+        if self.command_log != None:
+            self.command_log.truncate()
+
+    def take_changes(self) -> tuple[set[str], set[str], set[str], set[str]]:
+        # like checkpoint, but hands back what was dirty so it can be put back if the save fails
+        changes = (self._dirty_objects, self._removed_objects, self._dirty_listeners, self._dirty_timers)
+        self._dirty_objects = set()
+        self._removed_objects = set()
+        self._dirty_listeners = set()
+        self._dirty_timers = set()
+        return changes
+
+    def restore_changes(self, changes : tuple[set[str], set[str], set[str], set[str]]):
+        objects, removed, listeners, timers = changes
+        self._dirty_objects |= { obj_id for obj_id in objects if obj_id in self.game_objects }
+        self._removed_objects |= { obj_id for obj_id in removed if obj_id not in self.game_objects }
+        self._dirty_listeners |= listeners
+        self._dirty_timers |= timers
+
+    def has_changes(self) -> bool:
+        return len(self._dirty_objects) + len(self._removed_objects) + len(self._dirty_listeners) + len(self._dirty_timers) > 0
+
+    def obj_from_dict(self, data : dict, notify : bool = True) -> GameObject:
+        # names are resolved through the lookup tables and set in one go, instead of being imbued one at a time
         new_obj = GameObject(data.get("id"))
+        new_obj.prototype = data.get("prototype")
         new_obj.states = data.get("state")
-        self.imbue_reactions(new_obj, data.get("reactions"))
-        self.imbue_skills(new_obj, data.get("skills"))
+        reactions = data.get("reactions")
+        if reactions:
+            new_obj.reactions = [ self.reactions.by_name[name] for name in reactions ]
+        skills = data.get("skills")
+        if skills:
+            new_obj.skills = [ self.get_skill_id(name) for name in skills ]
+        if notify:
+            self.update_user(new_obj)
         return new_obj
 
-    def load_state(self, state_obj : dict):
-        # should probably suspend all operations and clear state first... 
-        for obj in state_obj.get("objects"):
-            new_obj = self.obj_from_dict(obj) 
-            self.add_object(new_obj)
+    def _load_timer(self, timer : dict):
+        due = timer.get("due")
+        delay = timer.get("delay") if due == None else due - self.game_time # older saves store delays
+        self.schedule(delay, timer.get("listener"), timer.get("script"), timer.get("data"), timer.get("id"))
 
-        for ev, listeners in state_obj.get("listeners").items():
+    def load_header(self, header : dict):
+        self.clock_from_dict(header)
+
+        for ev, listeners in header.get("listeners").items():
             for listener in listeners:
                 self.register_event(ev, listener.get("listener"), listener.get("script"))
 
+        for timer in header.get("timers", []):
+            self._load_timer(timer)
+
+    def load_objects(self, objects : Iterable[dict]):
+        # objects can come from a generator, so a snapshot doesn't have to be read in full before loading starts.
+        # user data is only synced once the whole batch is in
+        users = []
+        for obj in objects:
+            new_obj = self.obj_from_dict(obj, notify=False)
+            self.add_object(new_obj)
+            if self.interface.is_user(new_obj.id):
+                users.append(new_obj)
+        for user in users:
+            self.update_user(user)
+
+    def load_state(self, state_obj : dict):
+        # should probably suspend all operations and clear state first... 
+        self.load_header(state_obj)
+        self.load_objects(state_obj.get("objects"))
+
+    def apply_delta(self, delta : dict):
+        self.clock_from_dict(delta)
+
+        for obj_id in delta.get("removed"):
+            if self.get_by_id(obj_id) != None:
+                self.remove_obj(obj_id)
+
+        for obj in delta.get("objects"):
+            self.replace_object(self.obj_from_dict(obj))
+
+        for listener, subscriptions in delta.get("listeners").items():
+            self.unregister_listener(listener)
+            for subscription in subscriptions:
+                self.register_event(subscription.get("event"), listener, subscription.get("script"))
+
+        for timer_id in delta.get("cancelled"):
+            self.cancel(timer_id)
+
+        for timer in delta.get("timers"):
+            self._load_timer(timer)
+
+    def new_id(self) -> str:
+        # short ids are cheaper to store and index than uuid strings; the namespace prefix keeps them from clashing with
+        # ids chosen by hand (e.g. "room") or with objects made in another world
+        self.next_id += 1
+        return f"{self.id_namespace[:8]}:{self.next_id:x}"
+
+    def log(self, record_type : str, **data):
+        if self.command_log == None:
+            return
+        self.log_seq += 1
+        self.command_log.append({ "seq": self.log_seq, "tick": self.tick_number, "type": record_type, **data })
+
+    def replay(self, records : Iterable[dict]) -> list[str]:
+        # brings the world forward from its last snapshot by rerunning logged ticks. scripts and timers don't need to be
+        # logged since running the same ticks over the same world runs them again. returns the ids of objects the log
+        # added and never removed, which after a crash are whatever was still connected.
+        commands = []
+        command_tick = None
+        added : dict[str, None] = dict()
+        for record in records:
+            if record["seq"] <= self.log_seq:
+                continue
+            if record["type"] == "command":
+                if record["tick"] != command_tick and len(commands) > 0:
+                    self._replay_tick(command_tick, commands)
+                    commands = []
+                command_tick = record["tick"]
+                commands.append(record)
+            else:
+                if len(commands) > 0:
+                    self._replay_tick(command_tick, commands)
+                    commands = []
+                self._replay_ticks_until(record["tick"])
+                if record["type"] == "add":
+                    obj = self.obj_from_dict(record["obj"])
+                    self.add_object(obj)
+                    added[obj.id] = None
+                elif record["type"] == "remove":
+                    added.pop(record["id"], None)
+                    if self.get_by_id(record["id"]) != None:
+                        self.remove_obj(record["id"])
+                elif record["type"] == "skip":
+                    self.game_time += record["count"] * self.tick_time
+            self.log_seq = record["seq"]
+        if len(commands) > 0:
+            self._replay_tick(command_tick, commands)
+        return [ id for id in added if self.get_by_id(id) != None ]
+
+    def _replay_ticks_until(self, tick_number : int):
+        while self.tick_number < tick_number:
+            self._run_tick([])
+
+    def _replay_tick(self, tick_number : int, commands : list[dict]):
+        self._replay_ticks_until(tick_number - 1)
+        self._run_tick(commands)
+
     def parse(self, raw : str, user):
+        self.log("command", id=user, raw=raw)
         split = Game.split_args(raw)
         if len(split) > 0 and split[0] in Game._default_commands:
-            Game._default_commands[split[0]][1](self, user)
+            if self.profiler == None:
+                Game._default_commands[split[0]][1](self, user)
+            else:
+                self.profiler.call("command", split[0], Game._default_commands[split[0]][1], self, user)
         elif len(split) > 0 and split[0] in self._skill_parse_dict:
             # this is STILL wrong because we need the player object to be set up as a receiver for inputs
             skill_id = self._skill_parse_dict.get(split[0])
-            self.skills.get(skill_id).on_parsed(self, split, skill_id, user)
+            self._run_skill(self.skills.get(skill_id), split, user)
+
+    def _run_skill(self, skill : Skill, split : list[str], caller_id):
+        if self.profiler == None:
+            skill.on_parsed(self, split, skill.id, caller_id)
+        else:
+            self.profiler.call("skill", skill.name, skill.on_parsed, self, split, skill.id, caller_id)
+
+    def _run_reaction(self, reaction : Reaction, actor_id, target_id, params):
+        if self.profiler == None:
+            return reaction.callback(self, actor_id, target_id, params)
+        return self.profiler.call("reaction", reaction.name, reaction.callback, self, actor_id, target_id, params)
+
+    def _run_script(self, script_name : str, listener_id : str, data : EventData):
+        script = self.scripts.get_by_name(script_name)
+        if self.profiler == None:
+            script.callback(self, listener_id, data)
+        else:
+            self.profiler.call("script", script_name, script.callback, self, listener_id, data)
 
     def get_by_state(self, state_id, eval_fn):
         # this builds a pretty strong case for having a state manager rather than having GameObjects handle their own state
@@ -161,40 +426,223 @@ class Game:
         # a given GameObject thinks it ought to be doing
         return [
             y
-            for y in self.game_objects.values()
+            for y in self.all_objects()
             if state_id in y.states
             if eval_fn(y.states[state_id])
         ]
     
+    def get_in_location(self, location_id) -> list[GameObject]:
+        self._load_location(location_id)
+        contents = self.location_index.get(location_id)
+        if contents == None:
+            return []
+        return [ self.game_objects[obj_id] for obj_id in contents ]
+
+    def _index_location(self, obj_id : str, old, new):
+        if old is not MISSING:
+            contents = self.location_index.get(old)
+            if contents != None:
+                contents.pop(obj_id, None)
+                if len(contents) == 0:
+                    del self.location_index[old]
+        if new is not MISSING:
+            self.location_index.setdefault(new, dict())[obj_id] = None
+
+    def on_state_changed(self, obj : GameObject, key, old, new):
+        # called by GameObject.states whenever a state is set or removed
+        self._dirty_objects.add(obj.id)
+        if key == "location" and old != new:
+            self._index_location(obj.id, old, new)
+
+    def on_object_changed(self, obj : GameObject, attribute : str):
+        # called by GameObject when its skills or reactions change
+        self._dirty_objects.add(obj.id)
+        if attribute == "reactions" and obj.id in self.instances:
+            self._reaction_dispatch.clear() # objects using this one as a prototype may react differently now
+        elif attribute == "reactions":
+            self._invalidate_reactions(obj.id)
+
+    def on_prototype_changed(self, obj : GameObject, old : str, new : str):
+        # called by GameObject before its prototype changes
+        prototype_id = new
+        while prototype_id != None:
+            if prototype_id == obj.id:
+                raise ValueError(f"Making {new} the prototype of {obj.id} would make a loop.")
+            prototype = self.get_by_id(prototype_id)
+            prototype_id = None if prototype == None else prototype.prototype
+        self._index_instance(obj.id, old, new)
+        self.on_object_changed(obj, "reactions")
+
+    def _index_instance(self, obj_id : str, old : str, new : str):
+        if old != None:
+            instances = self.instances.get(old)
+            if instances != None:
+                instances.discard(obj_id)
+                if len(instances) == 0:
+                    del self.instances[old]
+        if new != None:
+            self.instances.setdefault(new, set()).add(obj_id)
+
+    def skill_ids_of(self, obj : GameObject) -> set:
+        # own skills and everything inherited from prototypes
+        skill_ids = set(obj.skill_ids())
+        prototype = obj.get_prototype()
+        if prototype != None:
+            skill_ids |= self.skill_ids_of(prototype)
+        return skill_ids
+
+    def reaction_ids_of(self, obj : GameObject) -> set:
+        reaction_ids = set(obj.reaction_ids())
+        prototype = obj.get_prototype()
+        if prototype != None:
+            reaction_ids |= self.reaction_ids_of(prototype)
+        return reaction_ids
+
     def use_skill(self, raw, caller_id):
-        split = Game.split_args(raw)
+        split = tokenizer.split_args_cached(raw)
         skill_id = self._skill_parse_dict.get(split[0])
-        self.skills.get(skill_id).on_parsed(self, split, skill_id, caller_id)
+        self._run_skill(self.skills.get(skill_id), split, caller_id)
 
     def get_by_id(self, id_ : str):
-        return self.game_objects.get(id_)
+        obj = self.game_objects.get(id_)
+        if obj == None and self._snapshot != None and id_ not in self._snapshot_removed:
+            obj = self._load_from_snapshot(id_)
+        return obj
+
+    def attach_snapshot(self, snapshot : BinarySnapshot):
+        # loads the header now and every object the first time it's needed
+        self._snapshot = snapshot
+        self.load_header(snapshot.header())
+
+    def _load_from_snapshot(self, id_ : str) -> GameObject:
+        data = self._snapshot.load(id_)
+        if data == None:
+            return None
+        obj = self.obj_from_dict(data)
+        self.add_object(obj)
+        self._dirty_objects.discard(id_) # still the same as what's saved
+        return obj
+
+    def _load_location(self, location_id):
+        if self._snapshot == None or location_id in self._snapshot_locations:
+            return
+        self._snapshot_locations.add(location_id)
+        for obj_id in self._snapshot.ids_in_location(location_id):
+            self.get_by_id(obj_id)
+
+    def all_objects(self) -> Iterable[GameObject]:
+        # anything which needs the whole world reads everything left in the snapshot first
+        if self._snapshot != None:
+            for obj_id in self._snapshot.iter_ids():
+                self.get_by_id(obj_id)
+            self._snapshot.close()
+            self._snapshot = None
+        return self.game_objects.values()
 
     def add_script(self, script : Script):
-        self.scripts[script.name] = script
+        self.scripts.add(script)
     
     def add_scripts(self, scripts : Iterable[Script]):
         for script in scripts:
             self.add_script(script)
 
     def register_event(self, event_name : str, listener : str, script : str):
-        if event_name not in self.listeners:
-            self.listeners[event_name] = []
-        self.listeners[event_name].append(ListenerData(listener, script))
-
-    def call_event(self, event_name : str, data : EventData):
-        listeners : list[ListenerData] = self.listeners.get(event_name)
-        if listeners == None or not isinstance(listeners, list) or len(listeners) == 0:
+        subscriptions = self.listeners.setdefault(event_name, dict())
+        if (listener, script) in subscriptions:
+            return
+        data = ListenerData(listener, script)
+        subscriptions[(listener, script)] = data
+        self._subscriptions.setdefault(listener, dict())[(event_name, script)] = data
+        self._dirty_listeners.add(listener)
+
+    def unregister_event(self, event_name : str, listener : str, script : str) -> bool:
+        subscriptions = self.listeners.get(event_name)
+        if subscriptions == None or subscriptions.pop((listener, script), None) == None:
+            return False
+        if len(subscriptions) == 0:
+            del self.listeners[event_name]
+        by_listener = self._subscriptions[listener]
+        del by_listener[(event_name, script)]
+        self._dirty_listeners.add(listener)
+        if len(by_listener) == 0:
+            del self._subscriptions[listener]
+        return True
+
+    def unregister_listener(self, listener : str):
+        # drops every subscription held by the listener
+        for event_name, script in list(self._subscriptions.get(listener, ())):
+            self.unregister_event(event_name, listener, script)
+
+    def call_event(self, event_name : str, data : EventData, location : str = None):
+        # with a location, only listeners contained in that location hear the event
+        subscriptions = self.listeners.get(event_name)
+        if subscriptions == None:
             return
-        for listener in listeners:
-            self.scripts[listener.script].callback(self, listener.listener, data)
+        if location == None:
+            targets = list(subscriptions.values())
+        else:
+            self._load_location(location)
+            contents = self.location_index.get(location, ())
+            if len(contents) < len(subscriptions):
+                targets = [
+                    listener
+                    for obj_id in contents
+                    for (ev, _), listener in self._subscriptions.get(obj_id, {}).items()
+                    if ev == event_name
+                ]
+            else:
+                targets = [ listener for listener in subscriptions.values() if listener.listener in contents ]
+        for listener in targets:
+            # an earlier callback may have unsubscribed this one
+            if (listener.listener, listener.script) in subscriptions:
+                self._run_script(listener.script, listener.listener, data)
             
+    def schedule(self, delay : float, obj_id : str, script_name : str, data : Any = None, timer_id : str = None) -> str:
+        # runs the script once, delay seconds of game time from now; data should be json serialisable so it can be saved
+        if timer_id == None:
+            timer_id = self.new_id()
+        elif timer_id in self.timers:
+            self.cancel(timer_id)
+        self._add_timer(Timer(timer_id, self.game_time + delay, obj_id, script_name, data))
+        return timer_id
+
+    def _add_timer(self, timer : Timer):
+        self.timers[timer.id] = timer
+        self._timers_by_listener.setdefault(timer.listener, set()).add(timer.id)
+        self._dirty_timers.add(timer.id)
+        self._timer_seq += 1
+        heapq.heappush(self._timer_heap, (timer.due, self._timer_seq, timer.id))
+
+    def _forget_timer(self, timer : Timer):
+        self._dirty_timers.add(timer.id)
+        by_listener = self._timers_by_listener.get(timer.listener)
+        by_listener.discard(timer.id)
+        if len(by_listener) == 0:
+            del self._timers_by_listener[timer.listener]
+
+    def cancel(self, timer_id : str) -> bool:
+        timer = self.timers.pop(timer_id, None)
+        if timer == None:
+            return False
+        self._forget_timer(timer)
+        if len(self._timer_heap) > 2 * len(self.timers) + 64:
+            self._timer_heap = [ entry for entry in self._timer_heap if entry[2] in self.timers ]
+            heapq.heapify(self._timer_heap)
+        return True
+
+    def _fire_timers(self):
+        heap = self._timer_heap
+        now = self.game_time + 1e-9 # game time is a sum of floats, so allow for rounding
+        while len(heap) > 0 and heap[0][0] <= now:
+            _, _, timer_id = heapq.heappop(heap)
+            timer = self.timers.pop(timer_id, None)
+            if timer == None:
+                continue
+            self._forget_timer(timer)
+            self._run_script(timer.script, timer.listener, EventDataOnTimer(self.game_time, timer.id, timer.data))
+
     def add_skill(self, skill : Skill):
-        self.skills[skill.id] = skill
+        self.skills.add(skill)
         self._skill_parse_dict[skill.name.lower()] = skill.id
         for synonym in skill.synonyms:
             self._skill_parse_dict[synonym.lower()] = skill.id
@@ -203,80 +651,136 @@ class Game:
         for skill in skills:
             self.add_skill(skill)
 
+    def update_user(self, obj : GameObject):
+        # only worth building the dict for objects which belong to a user
+        if self.interface.is_user(obj.id):
+            self.interface.update_user(self.obj_to_dict(obj))
+
     def imbue_skill(self, obj : GameObject, skill : str):
-        skill_id = self.get_skill_id(skill)
-        obj.skills.add(skill_id)
-        self.interface.update_user(self.obj_to_dict(obj))
+        self.imbue_skills(obj, (skill,))
 
     def imbue_skills(self, obj : GameObject, skills : Iterable[str]):
         for skill in skills:
-            self.imbue_skill(obj, skill)
+            obj.skills.add(self.get_skill_id(skill))
+        self.update_user(obj)
 
     def imbue_reaction(self, obj : GameObject, reaction : str):
-        reaction_obj = self.get_reactions_by_name(reaction)[0]
-        obj.reactions.add(reaction_obj.id)
-        self.interface.update_user(self.obj_to_dict(obj))
+        self.imbue_reactions(obj, (reaction,))
 
     def imbue_reactions(self, obj : GameObject, reactions : Iterable[str]):
         for reaction in reactions:
-            self.imbue_reaction(obj, reaction)
+            obj.reactions.add(self.reactions.by_name[reaction])
+        self.update_user(obj)
 
     def add_reactions(self, reactions : Iterable[Reaction]):
         for reaction in reactions:
             self.add_reaction(reaction)
 
     def add_object(self, obj : GameObject):
+        existing = self.game_objects.get(obj.id)
+        if existing != None and existing is not obj:
+            self.remove_obj(obj.id)
         self.game_objects[obj.id] = obj
+        obj.game = self
+        self._dirty_objects.add(obj.id)
+        self._removed_objects.discard(obj.id)
+        self._index_location(obj.id, MISSING, obj.states.get("location", MISSING))
+        self._index_instance(obj.id, None, obj.prototype)
+
+    def replace_object(self, obj : GameObject):
+        # a new version of an object, e.g. from a delta, which keeps the old one's subscriptions and timers. a delta only
+        # has the ones that changed, so the rest would be lost with the old object
+        subscriptions = list(self._subscriptions.get(obj.id, ()))
+        timers = [ self.timers[timer_id] for timer_id in self._timers_by_listener.get(obj.id, ()) ]
+        self.add_object(obj)
+        for event_name, script in subscriptions:
+            self.register_event(event_name, obj.id, script)
+        for timer in timers:
+            if timer.id not in self.timers:
+                self._add_timer(timer)
 
     def remove_obj(self, id):
-        del self.game_objects[id] # likely not very clean, but ok for now
+        obj = self.game_objects.pop(id) # likely not very clean, but ok for now
+        if self._snapshot != None:
+            self._snapshot_removed.add(id)
+        self._dirty_objects.discard(id)
+        self._removed_objects.add(id)
+        self._index_location(id, obj.states.get("location", MISSING), MISSING)
+        self._index_instance(id, obj.prototype, None)
+        if id in self.instances:
+            self._reaction_dispatch.clear()
+        else:
+            self._invalidate_reactions(id)
+        self.unregister_listener(id)
+        for timer_id in list(self._timers_by_listener.get(id, ())):
+            self.cancel(timer_id)
+        obj.game = None
 
     def register_on_tick(self, obj_id : uuid.UUID):
         self.on_tick_listeners.add(obj_id)
 
     def add_reaction(self, reaction : Reaction):
-        self.reactions[reaction.id] = reaction
-        skill_id = self.get_skill_id(reaction.reacting_to)
-        reaction_list = self._reaction_parse_dict.get(skill_id)
-        if reaction_list != None:
-            reaction_list.append(reaction.id)
-        else:
-            reaction_list = [reaction.id]
-        self._reaction_parse_dict[skill_id] = reaction_list
+        self.reactions.add(reaction)
+        self._reaction_dispatch.clear()
 
     def get_reactions(self, reacts_to : str):
         skill_id = self._skill_parse_dict.get(reacts_to)
         if skill_id == None:
             return []
-        reaction_ids = self._reaction_parse_dict.get(skill_id)
-        if reaction_ids == None:
-            return []
-        return reaction_ids
+        return self.reactions.in_group(skill_id)
 
     def get_reactions_by_name(self, name : str):
-        return list([reaction for reaction in self.reactions.values() if reaction.name == name])
-
-    def react_to(self, actor_id, skill_id, target_id, params = {}):
-        target : GameObject = self.get_by_id(target_id)
-
-        target_reactions = [ 
-            self.reactions.get(reaction_id)
-            for reaction_id in target.reactions
-            if self._reaction_parse_dict.get(skill_id) != None
-        ]
-
-        final_targets = [
-            reaction
-            for reaction in target_reactions
-            if reaction.id in self._reaction_parse_dict.get(skill_id)
-        ]
+        reaction = self.reactions.get_by_name(name)
+        return [] if reaction == None else [reaction]
+
+    def _invalidate_reactions(self, obj_id : str):
+        for skill_id in self.reactions.groups:
+            self._reaction_dispatch.pop((skill_id, obj_id), None)
+
+    def _resolve_reaction(self, actor_id, skill_id, target : GameObject) -> Reaction:
+        skill_reactions = self.reactions.groups.get(skill_id)
+        final_targets = []
+        # an object's own reactions win over the ones it inherits
+        obj = target
+        while skill_reactions != None and obj != None and len(final_targets) == 0:
+            final_targets = [
+                self.reactions.get(reaction_id)
+                for reaction_id in obj.reaction_ids()
+                if reaction_id in skill_reactions
+            ]
+            obj = obj.get_prototype()
 
         if len(final_targets) > 1:
             self.io.add_output(f"Warning: more than one reaction to {skill_id} in {actor_id}. Only executing the first one.")
-        if len(final_targets) > 0:
-            return final_targets[0].callback(self, actor_id, target_id, params)
+        reaction = final_targets[0] if len(final_targets) > 0 else None
+        self._reaction_dispatch[(skill_id, target.id)] = reaction
+        return reaction
+
+    def react_to(self, actor_id, skill_id, target_id, params = {}):
+        reaction = self._reaction_dispatch.get((skill_id, target_id), MISSING)
+        if reaction is MISSING:
+            reaction = self._resolve_reaction(actor_id, skill_id, self.get_by_id(target_id))
+        if reaction != None:
+            return self._run_reaction(reaction, actor_id, target_id, params)
         return None
 
+    def react_to_many(self, actor_id, skill_id, target_ids : Iterable[str], params = {}) -> list:
+        # same as calling react_to for each target, for skills which fan out over a whole room
+        dispatch = self._reaction_dispatch
+        profiler = self.profiler
+        results = []
+        for target_id in target_ids:
+            reaction = dispatch.get((skill_id, target_id), MISSING)
+            if reaction is MISSING:
+                reaction = self._resolve_reaction(actor_id, skill_id, self.get_by_id(target_id))
+            if reaction == None:
+                results.append(None)
+            elif profiler == None:
+                results.append(reaction.callback(self, actor_id, target_id, params))
+            else:
+                results.append(profiler.call("reaction", reaction.name, reaction.callback, self, actor_id, target_id, params))
+        return results
+
     def get_skill_id(self, skill_name):
         return self._skill_parse_dict.get(skill_name)
 
@@ -284,9 +788,60 @@ class Game:
     #     skill_id = self._skill_parse_dict.get(skill_name)
     #     self.skills.get(skill_id).on_parsed(self, [skill_name] + args, skill_id, caller_id)
 
-    async def tick(self):
+    def _run_tick(self, replayed_commands : list[dict] = None):
+        start = time.perf_counter()
+        self.tick_number += 1
         self.game_time += self.tick_time
+        if replayed_commands != None:
+            for record in replayed_commands:
+                try:
+                    self.parse(record["raw"], record["id"])
+                except Exception:
+                    traceback.print_exc()
+        elif self.interface != None:
+            self.interface.poll() # player commands queued since the last tick
+        self._fire_timers()
         self.call_event("tick", EventDataOnTick(self.game_time))
+        if self.command_log != None:
+            self.command_log.sync()
+        if self.interface != None:
+            self.interface.flush() # after the sync, so nobody sees the result of a command which could still be lost
+        self.tick_stats.record_work(time.perf_counter() - start)
+
+    def _skip_ticks(self, count : int):
+        # skipped ticks still move game time on, so that game time keeps pace with wall time
+        if count <= 0:
+            return
+        self._next_deadline += count * self.tick_time
+        self.game_time += count * self.tick_time
+        self.tick_stats.skipped += count
+        self.log("skip", count=count)
+
+    async def _tick_deadline(self):
+        now = time.monotonic()
+        if self._next_deadline == None:
+            self._next_deadline = now
+        self.tick_stats.record_lateness(max(0.0, now - self._next_deadline))
+
+        self._run_tick()
+
+        self._next_deadline += self.tick_time
+        behind = time.monotonic() - self._next_deadline
+        if behind > 0:
+            self.tick_stats.overruns += 1
+            missed = int(behind // self.tick_time) # whole periods we won't make, not counting the (late) next tick
+            if self.overrun_policy == "skip":
+                self._skip_ticks(missed)
+            elif missed > self.max_catch_up:
+                self._skip_ticks(missed - self.max_catch_up)
+
+        await asyncio.sleep(max(0.0, self._next_deadline - time.monotonic()))
+
+    async def tick(self):
+        if self.scheduler == "deadline":
+            await self._tick_deadline()
+            return
+        self._run_tick()
         # for id in self.on_tick_listeners:
         #     self.game_objects.get(id).on_tick(self, self.game_time, id)
         # raw = input("> ")
@@ -298,7 +853,9 @@ class Game:
         await asyncio.sleep(self.tick_time)
     
     def tick_sync(self):
+        self.tick_number += 1
         self.game_time += self.tick_time
+        self._fire_timers()
         self.call_event("tick", EventDataOnTick(self.game_time))
         # raw = input("> ")
         self.io.poll()
@@ -1,18 +1,267 @@
+import sys
 import uuid
+from copy import deepcopy
 from typing import Callable, Any
+from registry import stable_id
+
+MISSING = object() # marks a state key that didn't exist before / doesn't exist after a change
+
+# the states almost every object has. state keys are interned when they're set, so objects loaded from json share one
+# copy of each key string rather than holding their own
+NAME = sys.intern("name")
+DESCRIPTION = sys.intern("description")
+LOCATION = sys.intern("location")
+
+_EMPTY = frozenset()
+
+# states an object never takes from its prototype. the game indexes locations, so an object is only ever where it says it is
+NOT_INHERITED = frozenset({LOCATION})
+
+class StateDict(dict):
+    # a dict which tells the object that owns it about every write, so the game can keep indexes (e.g. location) up to date
+    __slots__ = ("owner",)
+
+    def __init__(self, owner : "GameObject", data : dict = None):
+        super().__init__()
+        self.owner : GameObject = owner
+        if data != None:
+            self.update(data)
+
+    # reads fall through to the owner's prototype for keys the owner doesn't set itself. writes, deletes and iteration only
+    # ever see the owner's own states, which is also all that gets saved
+    def __missing__(self, key):
+        prototype = None if key in NOT_INHERITED else self.owner.get_prototype()
+        if prototype == None:
+            raise KeyError(key)
+        return prototype.states[key]
+
+    def get(self, key, default = None):
+        if dict.__contains__(self, key):
+            return dict.__getitem__(self, key)
+        prototype = None if key in NOT_INHERITED else self.owner.get_prototype()
+        if prototype == None:
+            return default
+        return prototype.states.get(key, default)
+
+    def __contains__(self, key):
+        if dict.__contains__(self, key):
+            return True
+        prototype = None if key in NOT_INHERITED else self.owner.get_prototype()
+        return prototype != None and key in prototype.states
+
+    def __setitem__(self, key, value):
+        if type(key) is str:
+            key = sys.intern(key)
+        old = dict.get(self, key, MISSING)
+        dict.__setitem__(self, key, value)
+        self.owner.on_state_changed(key, old, value)
+
+    def __delitem__(self, key):
+        old = dict.__getitem__(self, key)
+        dict.__delitem__(self, key)
+        self.owner.on_state_changed(key, old, MISSING)
+
+    def pop(self, key, *default):
+        if dict.__contains__(self, key):
+            value = dict.__getitem__(self, key)
+            del self[key]
+            return value
+        return dict.pop(self, key, *default)
+
+    def popitem(self):
+        key, value = dict.popitem(self)
+        self.owner.on_state_changed(key, value, MISSING)
+        return key, value
+
+    def setdefault(self, key, default = None):
+        if key not in self:
+            self[key] = default
+        return dict.__getitem__(self, key)
+
+    def update(self, *args, **kwargs):
+        if self.owner.game == None:
+            # nobody to tell, which is the common case while loading
+            dict.update(self, ( (sys.intern(key) if type(key) is str else key, value) for key, value in dict(*args, **kwargs).items() ))
+            return
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        if len(self) == 0:
+            return
+        for key in list(self.keys()):
+            del self[key]
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def __deepcopy__(self, memo):
+        # copies are plain data and shouldn't drag the owner along with them
+        return deepcopy(dict(self), memo)
+
+class TrackedSet(set):
+    # a set which tells the object that owns it when it changes, so the game knows what needs saving
+    __slots__ = ("owner", "name")
+
+    def __init__(self, owner : "GameObject", name : str, data = ()):
+        super().__init__(data)
+        self.owner : GameObject = owner
+        self.name : str = name # which attribute of the owner this is
+
+    def _changed(self):
+        self.owner.on_changed(self.name)
+
+    def add(self, item):
+        if item not in self:
+            set.add(self, item)
+            self._changed()
+
+    def discard(self, item):
+        if item in self:
+            set.discard(self, item)
+            self._changed()
+
+    def remove(self, item):
+        set.remove(self, item)
+        self._changed()
+
+    def pop(self):
+        item = set.pop(self)
+        self._changed()
+        return item
+
+    def clear(self):
+        set.clear(self)
+        self._changed()
+
+    def update(self, *others):
+        set.update(self, *others)
+        self._changed()
+
+    def difference_update(self, *others):
+        set.difference_update(self, *others)
+        self._changed()
+
+    def intersection_update(self, *others):
+        set.intersection_update(self, *others)
+        self._changed()
+
+    def symmetric_difference_update(self, other):
+        set.symmetric_difference_update(self, other)
+        self._changed()
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def __iand__(self, other):
+        self.intersection_update(other)
+        return self
+
+    def __isub__(self, other):
+        self.difference_update(other)
+        return self
+
+    def __ixor__(self, other):
+        self.symmetric_difference_update(other)
+        return self
+
+    def __deepcopy__(self, memo):
+        return deepcopy(set(self), memo)
 
 class GameObject:
+    # there can be millions of these, so no instance __dict__ and no skill / reaction sets until something is added
+    __slots__ = ("id", "game", "_states", "_skills", "_reactions", "_prototype")
+
     def __init__(self, id = None):
-        self.id : str = str(uuid.uuid4())
-        if id != None:
-            self.id = id
-        self.states : dict = dict() # keys strings to some other data, usually attached / managed by skills
-        self.skills : set = set() # set of *ids* of available skills
-        self.reactions : set = set() # set of *ids* of reactions
+        self.id : str = str(uuid.uuid4()) if id == None else id
+        self.game = None # set by Game.add_object, used to report state changes
+        self._states : StateDict = StateDict(self) # keys strings to some other data, usually attached / managed by skills
+        self._skills : TrackedSet = None # set of *ids* of available skills
+        self._reactions : TrackedSet = None # set of *ids* of reactions
+        self._prototype : str = None # id of an object to take states, skills and reactions from when this one doesn't have them
+
+    @property
+    def states(self) -> StateDict:
+        return self._states
+
+    @states.setter
+    def states(self, value : dict):
+        if value is self._states:
+            return
+        self._states.clear()
+        self._states.update(value)
+
+    @property
+    def skills(self) -> TrackedSet:
+        if self._skills == None:
+            self._skills = TrackedSet(self, "skills")
+        return self._skills
+
+    @skills.setter
+    def skills(self, value : set):
+        if value is not self._skills:
+            self._skills = TrackedSet(self, "skills", value)
+            self.on_changed("skills")
+
+    @property
+    def reactions(self) -> TrackedSet:
+        if self._reactions == None:
+            self._reactions = TrackedSet(self, "reactions")
+        return self._reactions
+
+    @reactions.setter
+    def reactions(self, value : set):
+        if value is not self._reactions:
+            self._reactions = TrackedSet(self, "reactions", value)
+            self.on_changed("reactions")
+
+    @property
+    def prototype(self) -> str:
+        return self._prototype
+
+    @prototype.setter
+    def prototype(self, value : str):
+        old = self._prototype
+        if value == old:
+            return
+        if self.game != None:
+            self.game.on_prototype_changed(self, old, value)
+        self._prototype = value
+
+    def get_prototype(self) -> "GameObject":
+        if self._prototype == None or self.game == None:
+            return None
+        return self.game.get_by_id(self._prototype)
+
+    def all_states(self) -> dict:
+        # own states on top of everything inherited
+        prototype = self.get_prototype()
+        if prototype == None:
+            return dict(self._states)
+        inherited = dict( (key, value) for key, value in prototype.all_states().items() if key not in NOT_INHERITED )
+        inherited.update(self._states)
+        return inherited
+
+    # read only views which don't allocate a set for objects without any
+    def skill_ids(self):
+        return _EMPTY if self._skills == None else self._skills
+
+    def reaction_ids(self):
+        return _EMPTY if self._reactions == None else self._reactions
+
+    def on_state_changed(self, key, old, new):
+        if self.game != None:
+            self.game.on_state_changed(self, key, old, new)
+
+    def on_changed(self, attribute : str):
+        if self.game != None:
+            self.game.on_object_changed(self, attribute)
 
 class Skill:
     def __init__(self, name : str, description : str = "Some skill.", synonyms : list[str] = [], on_parsed : Callable[["Game", list[str], str], Any] = None):
-        self.id : uuid.UUID = uuid.uuid4()
+        self.id : str = stable_id("skill", name)
         self.name : str = name
         self.description : str = description
         self.synonyms : str = synonyms
@@ -21,7 +270,7 @@ class Skill:
 class Reaction:
     def __init__(self, name : str, reaction_to : str, handle):
         self.name : str = name
-        self.id : str = uuid.uuid4()
-        self.reacting_to : str = reaction_to # id, not name
+        self.id : str = stable_id("reaction", name)
+        self.reacting_to : str = reaction_to # name of the skill
+        self.reacting_to_id : str = stable_id("skill", reaction_to)
         self.callback = handle
-
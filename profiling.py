@@ -0,0 +1,236 @@
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Callable
+
+# two ways of seeing where a tick goes:
+#   Profiler          call counts and latency histograms for every skill, reaction and script callback, by name. the game
+#                     only goes through it while one is attached (Game.profiler), so it costs one check per call when off.
+#                     times are inclusive: a skill's time includes the reactions it triggers.
+#   SamplingProfiler  periodic stack samples of every thread, for what happens inside a callback or outside the game
+
+MIN_SAMPLE_INTERVAL = 0.001 # seconds
+
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0) # upper bounds in seconds
+
+class Histogram:
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts : list[int] = [0] * (len(BUCKETS) + 1) # the last one is everything over the largest bound
+        self.count : int = 0
+        self.total : float = 0.0
+        self.max : float = 0.0
+
+    def observe(self, seconds : float):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q : float) -> float:
+        # upper bound of the bucket the quantile falls in, good enough to see what's slow
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return BUCKETS[i] if i < len(BUCKETS) else self.max
+        return self.max
+
+class Profiler:
+    KINDS = ("command", "skill", "reaction", "script")
+
+    def __init__(self):
+        self.histograms : dict[tuple[str, str], Histogram] = dict() # (kind, callback name) -> latencies
+        self.started : float = time.time()
+
+    def call(self, kind : str, name : str, callback : Callable, *args) -> Any:
+        start = time.perf_counter()
+        try:
+            return callback(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            histogram = self.histograms.get((kind, name))
+            if histogram == None:
+                histogram = self.histograms[(kind, name)] = Histogram()
+            histogram.observe(elapsed)
+
+    def reset(self):
+        self.histograms.clear()
+        self.started = time.time()
+
+    def top(self, count : int = 10) -> list[tuple[str, str, Histogram]]:
+        # the callbacks which took the most time in total
+        ranked = sorted(self.histograms.items(), key=lambda item : item[1].total, reverse=True)
+        return [ (kind, name, histogram) for (kind, name), histogram in ranked[:count] ]
+
+    def to_prometheus(self) -> str:
+        lines = [
+            "# HELP magic_callback_seconds Time spent in game callbacks.",
+            "# TYPE magic_callback_seconds histogram"
+        ]
+        for (kind, name), histogram in sorted(self.histograms.items()):
+            labels = f'kind="{escape_label(kind)}",name="{escape_label(name)}"'
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram.counts):
+                cumulative += count
+                lines.append(f'magic_callback_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'magic_callback_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+            lines.append(f"magic_callback_seconds_sum{{{labels}}} {histogram.total}")
+            lines.append(f"magic_callback_seconds_count{{{labels}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, file : str):
+        tmp_file = file + ".tmp"
+        with open(tmp_file, mode="w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_file, file)
+
+def escape_label(value : str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+class SamplingProfiler:
+    # periodic stack samples, for finding where the time goes inside a slow callback or the network code without
+    # restarting under a profiler. samples are kept in memory until written out as collapsed stacks (for flamegraph.pl /
+    # speedscope) or a chrome trace (chrome://tracing, perfetto). two ways of taking them:
+    #   signal  a SIGPROF timer interrupts the main thread, which is where the game and the network run, every interval
+    #           seconds of cpu time. the sample is wherever it was interrupted, so it's accurate, but it only sees the
+    #           main thread and can only be started from it
+    #   thread  a thread looks at every other thread through sys._current_frames. it can only do that while holding the
+    #           gil, so samples of a busy thread pile up where it lets go (waiting on io); good for seeing other threads
+    MODES = ("signal", "thread")
+
+    def __init__(self, interval : float = 0.005, mode : str = None, max_samples : int = 200000):
+        if mode == None:
+            mode = "signal" if hasattr(signal, "setitimer") and threading.current_thread() is threading.main_thread() else "thread"
+        if mode not in SamplingProfiler.MODES:
+            raise ValueError(f"Unknown sampling mode {mode}.")
+        if not MIN_SAMPLE_INTERVAL <= interval < float("inf"):
+            # much more often and sampling is most of what the main thread does; 0 would switch the signal timer off
+            raise ValueError(f"Sampling interval has to be at least {MIN_SAMPLE_INTERVAL} seconds, not {interval}.")
+        self.interval : float = interval
+        self.mode : str = mode
+        self.max_samples : int = max_samples
+        self.samples : list[tuple[float, int, tuple[str, ...]]] = [] # (time, thread id, stack from the outermost frame)
+        self.dropped : int = 0
+        self.started : float = None
+        self._running : bool = False
+        self._thread : threading.Thread = None
+        self._stop : threading.Event = threading.Event()
+        self._previous_handler = None
+        self._thread_names : dict[int, str] = dict()
+
+    def running(self) -> bool:
+        return self._running
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self.started = time.perf_counter()
+        if self.mode == "signal":
+            self._thread_names[threading.get_ident()] = threading.current_thread().name
+            self._previous_handler = signal.signal(signal.SIGPROF, self._on_signal)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        else:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if not self._running:
+            return
+        self._running = False
+        if self.mode == "signal":
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, self._previous_handler)
+        else:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _on_signal(self, signum, frame):
+        self._sample(time.perf_counter(), threading.get_ident(), frame)
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            for thread in threading.enumerate():
+                self._thread_names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    self._sample(now, thread_id, frame)
+
+    def _sample(self, now : float, thread_id : int, frame):
+        if len(self.samples) >= self.max_samples:
+            self.dropped += 1
+            return
+        stack = []
+        while frame != None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        stack.reverse()
+        self.samples.append((now, thread_id, tuple(stack)))
+
+    def _thread_name(self, thread_id : int) -> str:
+        return self._thread_names.get(thread_id, str(thread_id))
+
+    def collapsed(self) -> str:
+        counts : dict[str, int] = dict()
+        for _, thread_id, stack in self.samples:
+            key = ";".join((self._thread_name(thread_id),) + stack)
+            counts[key] = counts.get(key, 0) + 1
+        return "".join(f"{key} {count}\n" for key, count in sorted(counts.items()))
+
+    def chrome_trace(self) -> dict:
+        # a frame that stays on the stack over consecutive samples becomes one complete ("X") event
+        events = []
+        open_frames : dict[int, list[tuple[str, float]]] = dict() # thread id -> (frame, start) from the outermost
+        last_time : dict[int, float] = dict()
+        def close(thread_id : int, depth : int, end : float):
+            frames = open_frames[thread_id]
+            while len(frames) > depth:
+                name, start = frames.pop()
+                events.append({ "name": name, "ph": "X", "pid": os.getpid(), "tid": thread_id,
+                                "ts": (start - self.started) * 1e6, "dur": (end - start) * 1e6 })
+
+        for now, thread_id, stack in self.samples:
+            frames = open_frames.setdefault(thread_id, [])
+            common = 0
+            while common < len(frames) and common < len(stack) and frames[common][0] == stack[common]:
+                common += 1
+            close(thread_id, common, now)
+            for name in stack[common:]:
+                frames.append((name, now))
+            last_time[thread_id] = now
+        for thread_id in open_frames:
+            close(thread_id, 0, last_time[thread_id] + self.interval)
+
+        for thread_id in open_frames:
+            events.append({ "name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": thread_id,
+                            "args": { "name": self._thread_name(thread_id) } })
+        return { "traceEvents": events, "displayTimeUnit": "ms" }
+
+    def write(self, file : str):
+        # chrome trace json if the file name ends in .json, collapsed stacks otherwise
+        tmp_file = file + ".tmp"
+        with open(tmp_file, mode="w", encoding="utf-8") as f:
+            if file.endswith(".json"):
+                json.dump(self.chrome_trace(), f)
+            else:
+                f.write(self.collapsed())
+        os.replace(tmp_file, file)
+
+    def clear(self):
+        self.samples = []
+        self.dropped = 0
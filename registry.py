@@ -0,0 +1,83 @@
+import uuid
+from typing import Callable, Generic, Iterator, TypeVar
+
+# skills, reactions and scripts are each kept in one of these. ids are derived from what kind of thing it is and its name,
+# so the same content gets the same id on every boot and in every process, and anything keyed by them can be kept
+# across restarts.
+
+NAMESPACE = uuid.UUID("6f1c4d0e-5b7a-4c1e-9a53-2d8e0f3b7c41")
+
+def stable_id(kind : str, name : str) -> str:
+    return str(uuid.uuid5(NAMESPACE, f"{kind}:{name}"))
+
+T = TypeVar("T")
+
+class Registry(Generic[T]):
+    # items need an id and a name. group, if given, picks a key to index items by as well (e.g. the skill a reaction
+    # reacts to)
+    def __init__(self, kind : str, group : Callable[[T], str] = None):
+        self.kind : str = kind
+        self.by_id : dict[str, T] = dict()
+        self.by_name : dict[str, str] = dict() # name -> id
+        self.groups : dict[str, list[str]] = dict() # group key -> ids, in the order they were added
+        self._group : Callable[[T], str] = group
+
+    def add(self, item : T):
+        # adding something with a name that's already taken replaces the old one
+        old = self.by_id.get(item.id)
+        if old is item:
+            return
+        if old != None:
+            self.remove(old.id)
+        self.by_id[item.id] = item
+        self.by_name[item.name] = item.id
+        if self._group != None:
+            self.groups.setdefault(self._group(item), []).append(item.id)
+
+    def remove(self, id : str) -> T:
+        item = self.by_id.pop(id, None)
+        if item == None:
+            return None
+        if self.by_name.get(item.name) == id:
+            del self.by_name[item.name]
+        if self._group != None:
+            key = self._group(item)
+            ids = self.groups.get(key)
+            ids.remove(id)
+            if len(ids) == 0:
+                del self.groups[key]
+        return item
+
+    def get(self, id : str, default : T = None) -> T:
+        return self.by_id.get(id, default)
+
+    def get_by_name(self, name : str) -> T:
+        id = self.by_name.get(name)
+        return None if id == None else self.by_id[id]
+
+    def id_of(self, name : str) -> str:
+        return self.by_name.get(name)
+
+    def in_group(self, key : str) -> list[str]:
+        return self.groups.get(key, [])
+
+    def __getitem__(self, id : str) -> T:
+        return self.by_id[id]
+
+    def __contains__(self, id : str) -> bool:
+        return id in self.by_id
+
+    def __len__(self) -> int:
+        return len(self.by_id)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.by_id)
+
+    def keys(self):
+        return self.by_id.keys()
+
+    def values(self):
+        return self.by_id.values()
+
+    def items(self):
+        return self.by_id.items()
@@ -1,40 +1,149 @@
 import asyncio
+import os
+from collections import deque
 from dataclasses import dataclass, asdict
 from multiprocessing.sharedctypes import Value
-from types import NoneType
 import bcrypt
 import websockets
+from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
 import json
 from typing import Any, Union
 from client import connect
 from interfaces.magic_io import RichText
-from interfaces.NetIO import NetIO
+from interfaces.NetIO import NetIO, OutputStats
+from interfaces.wire import JSON, PROTOCOLS, Protocol, choose_protocol
 from magic_rpg import Game, GameObject
-from game.setup import game_setup, game_state_save, game_state_load
+from command_log import CommandLog
+from autosave import Autosave
+from game.setup import game_setup, game_state_save, game_state_save_delta, iter_game_state_load, ends_mid_line, sync_file, write_json_atomic
 from game.utilities import create_object, get_first_with_name
 
-JOIN : dict[str, Any] = dict()
+JOIN : dict[str, "Connection"] = dict()
 disconnecting = set()
 connected = set()
 shutdown = False
-to_send : asyncio.Queue["SendWrapper"] = asyncio.Queue()
-gm = Game(0.5)
+world_ready : asyncio.Event = asyncio.Event() # set once the world is loaded, replayed and logging, logins wait for it
+gm = Game(0.5, scheduler="deadline")
 user_data : dict[str, "UserData"] = dict()
-
-@dataclass
-class Output:
-    type : str
-    content : Union[RichText, str, list, NoneType]
-
-@dataclass
-class SendData:
-    type: str
-    data : Union[NoneType, Output]
-
-@dataclass
-class SendWrapper:
-    user : str
-    data : SendData
+SAVE_FILE = "last_quit.json"
+USERS_FILE = "users.json" # accounts, saved along with the world
+# accounts made since users.json was last saved, appended once a tick so they outlive a crash like their avatars do
+NEW_USERS_FILE = USERS_FILE + ".new"
+new_accounts : list["UserData"] = []
+DELTA_SAVE_INTERVAL = 30.0 # seconds of game time between incremental saves
+COMMAND_LOG_FILE = "commands.log" # everything since the last save, replayed after a crash
+START_ROOM = "room" # where new avatars are put
+AUTOSAVE_INTERVAL = 300.0 # seconds of game time between full saves, written in the background
+# how far one client can fall behind before OUTPUT_POLICY kicks in: "drop_oldest" throws away the oldest output,
+# "summarize" does the same but tells them how much they missed, "disconnect" drops the client
+OUTPUT_LIMIT_MESSAGES = 512
+OUTPUT_LIMIT_BYTES = 1 << 20
+OUTPUT_POLICY = "summarize"
+WIRE_PROTOCOLS = ("binary", "json") # what clients may ask for when they connect, anyone who doesn't ask gets json
+# permessage-deflate for clients which support it, COMPRESSION = None turns it off. smaller windows and memory levels
+# save memory per connection at the cost of compression
+COMPRESSION = "deflate"
+DEFLATE_WINDOW_BITS = 12 # 9 to 15
+DEFLATE_MEM_LEVEL = 5 # 1 to 9
+DEFLATE_LEVEL = 6 # 1 to 9
+
+class Connection:
+    # every client has its own writer, so a slow one only holds up its own output. what it hasn't written yet is
+    # limited in messages and bytes, so a stalled client can't take up unbounded memory
+    POLICIES = {"drop_oldest", "summarize", "disconnect"}
+
+    def __init__(self, user : str, socket, totals : OutputStats, max_messages : int = OUTPUT_LIMIT_MESSAGES,
+                 max_bytes : int = OUTPUT_LIMIT_BYTES, policy : str = OUTPUT_POLICY, protocol : Protocol = JSON):
+        if policy not in Connection.POLICIES:
+            raise ValueError(f"Unknown output policy {policy}.")
+        self.user : str = user
+        self.socket = socket
+        self.max_messages : int = max_messages
+        self.max_bytes : int = max_bytes
+        self.policy : str = policy
+        self.protocol : Protocol = protocol
+        self.stats : OutputStats = OutputStats()
+        self.totals : OutputStats = totals
+        self.frames : deque[tuple[Union[str, bytes], int]] = deque() # (frame, messages in it), json is ascii so len is bytes
+        self.missed : int = 0 # messages dropped since the last summary
+        self.closing : bool = False
+        self.closer : asyncio.Task = None
+        self.ready : asyncio.Event = asyncio.Event()
+        self.writer : asyncio.Task = asyncio.create_task(self.write_loop())
+
+    def send_frame(self, frame : Union[str, bytes], messages : int = 1):
+        if self.closing:
+            return
+        self.frames.append((frame, messages))
+        self._count_queued(messages, len(frame))
+        if self.stats.queued_messages > self.max_messages or self.stats.queued_bytes > self.max_bytes:
+            self._overflow()
+        self.ready.set()
+
+    def _count_queued(self, messages : int, size : int):
+        self.stats.queued_messages += messages
+        self.stats.queued_bytes += size
+        self.totals.queued_messages += messages
+        self.totals.queued_bytes += size
+
+    def _overflow(self):
+        if self.policy == "disconnect":
+            self.closing = True
+            self.stats.disconnects += 1
+            self.totals.disconnects += 1
+            while len(self.frames) > 0:
+                frame, messages = self.frames.popleft()
+                self._count_queued(-messages, -len(frame))
+            # the writer is most likely stuck in a send the client isn't reading, so don't wait for it, or for a closing
+            # handshake the client won't answer. the handler's recv fails and it cleans up as usual
+            self.writer.cancel()
+            transport = getattr(self.socket, "transport", None)
+            if transport != None:
+                transport.abort()
+            else:
+                self.closer = asyncio.create_task(self.socket.close())
+            return
+
+        while len(self.frames) > 0 and (self.stats.queued_messages > self.max_messages or self.stats.queued_bytes > self.max_bytes):
+            frame, messages = self.frames.popleft()
+            self._count_queued(-messages, -len(frame))
+            self.stats.dropped_messages += messages
+            self.totals.dropped_messages += messages
+            if self.policy == "summarize":
+                self.missed += messages
+
+    async def _send(self, frame : Union[str, bytes], messages : int):
+        await self.socket.send(frame)
+        self.stats.sent_messages += messages
+        self.stats.sent_bytes += len(frame)
+        self.totals.sent_messages += messages
+        self.totals.sent_bytes += len(frame)
+
+    async def write_loop(self):
+        try:
+            while True:
+                await self.ready.wait()
+                if self.missed > 0:
+                    # the dropped output was the oldest, so this goes before everything still queued
+                    summary = self.protocol.encode_output([f"You missed {self.missed} lines because your connection fell behind."])
+                    self.missed = 0
+                    self.stats.summaries += 1
+                    self.totals.summaries += 1
+                    await self._send(summary, 1)
+                    continue
+                if len(self.frames) == 0:
+                    self.ready.clear()
+                    continue
+                frame, messages = self.frames.popleft()
+                self._count_queued(-messages, -len(frame))
+                await self._send(frame, messages)
+        except websockets.ConnectionClosed:
+            return
+
+    def close(self):
+        self.writer.cancel()
+        self._count_queued(-self.stats.queued_messages, -self.stats.queued_bytes)
+        self.frames.clear()
 
 @dataclass
 class UserData:
@@ -52,28 +161,23 @@ async def parse(event, user):
         await net_io.parse(event["data"], user)
         # await send_message_all([RichText(f"{user}: ", 1), event["data"]])
 
-def format_message(msg):
-    if isinstance(msg, RichText):
-        return Output("RichText", msg)
-    elif isinstance(msg, str):
-        return Output("PlainText", msg)
-    elif isinstance(msg, list):
-        return Output("List", [ format_message(item) for item in msg ])
-
-async def send_message_websocket(socket, msg):
-    out = format_message(msg)
-    await socket.send(json.dumps(asdict(SendData("output",out))))
-
-async def send_message_to(user, msg):
-    output = format_message(msg)
+async def send_message_websocket(socket, msg, protocol : Protocol = JSON):
+    await socket.send(protocol.encode_output([msg]))
 
-    await to_send.put(SendWrapper(user, SendData("output", output)))
-
-async def send_message_all(msg):
-    output = format_message(msg)
+def send_messages_to(user, parts : list):
+    # parts are messages already encoded by NetIO.flush in the user's protocol, once each however many users they go to
+    connection = JOIN.get(user)
+    if connection == None:
+        return
+    connection.send_frame(connection.protocol.frame_from_parts(parts), len(parts))
 
-    for user in JOIN:
-        await to_send.put(SendWrapper(user, SendData("output", output)))
+def send_message_all(msg):
+    frames = dict()
+    for connection in JOIN.values():
+        frame = frames.get(connection.protocol.name)
+        if frame == None:
+            frame = frames[connection.protocol.name] = connection.protocol.encode_output([msg])
+        connection.send_frame(frame)
 
 def load_user_data(filepath):
     with open(filepath, "r", encoding="utf-8") as f:
@@ -85,6 +189,33 @@ def load_user_data(filepath):
                 continue
 
             user_data[username] = UserData(username, user.get("pass_hash"), user.get("data"))
+    load_new_accounts(NEW_USERS_FILE)
+
+def load_new_accounts(filepath):
+    if not os.path.exists(filepath):
+        return
+    with open(filepath, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                user = json.loads(line)
+            except json.JSONDecodeError:
+                # the last one can be half written if we crashed mid-write
+                continue
+            if isinstance(user, dict) and user.get("name") != None:
+                user_data[user["name"]] = UserData(user["name"], user.get("pass_hash"), user.get("data"))
+
+def save_new_accounts(filepath):
+    # one write and one sync for every account made this tick, rather than all of users.json for each
+    if len(new_accounts) == 0:
+        return
+    # don't run on from a line cut short by a crash
+    start = "\n" if ends_mid_line(filepath) else ""
+    with open(filepath, "a", encoding="utf-8") as f:
+        f.write(start)
+        for user in new_accounts:
+            f.write(json.dumps(asdict(user)) + "\n")
+        sync_file(f)
+    new_accounts.clear()
 
 def update_user_data(name, new_data):
     # this is an update function; don't allow creation of arbitrary data
@@ -94,11 +225,32 @@ def update_user_data(name, new_data):
     user.data = new_data    
 
 def save_user_data(filepath):
+    # avatars of users who are online have moved on since they logged in
+    for user, id in net_io.user_to_id.items():
+        avatar = gm.get_by_id(id)
+        if avatar != None:
+            update_user_data(user, gm.obj_to_dict(avatar))
     users = []
     for user in user_data.values():
         users.append(asdict(user))
-    with open(filepath, "w", encoding="utf-8") as f:
-        json.dump(users, f)
+    write_json_atomic(users, filepath)
+    # everything in there is in users.json now
+    new_accounts.clear()
+    if os.path.exists(NEW_USERS_FILE):
+        os.remove(NEW_USERS_FILE)
+
+def remove_ghost_avatars(added : list[str]):
+    # nobody is online before the game starts, so any avatar in the world was left behind by a crash, either in the
+    # snapshot or re-added by the log. whatever it did since its user's data was saved is kept
+    owners = { user.data.get("id"): user.name for user in user_data.values() if isinstance(user.data, dict) }
+    for id in dict.fromkeys([ *added, *owners ]):
+        avatar = gm.get_by_id(id)
+        if avatar == None:
+            continue
+        if id in owners:
+            update_user_data(owners[id], gm.obj_to_dict(avatar))
+        gm.remove_obj(id)
+        gm.log("remove", id=id)
 
 async def game_loop():
     # net_io = NetIO(gm.parse, send_message_to)
@@ -106,32 +258,45 @@ async def game_loop():
         print(net_io)
         gm.set_interface(net_io)
         print("Loading game state.")
-        load_user_data("users.json")
-        game_state_load(gm, "last_quit.json")
+        load_user_data(USERS_FILE)
+        for loaded in iter_game_state_load(gm, SAVE_FILE):
+            await asyncio.sleep(0) # keep the server responsive while a big world loads
+        print(f"Loaded {loaded} objects.")
+        print("Replaying command log.")
+        added = gm.replay(CommandLog.read(COMMAND_LOG_FILE))
+        gm.command_log = CommandLog(COMMAND_LOG_FILE)
+        remove_ghost_avatars(added)
+        gm.command_log.sync()
+        world_ready.set()
         print("Starting main game loop.")
         # game_setup(gm) # should probably hook into game.before_first_tick
+        next_delta_save = gm.game_time + DELTA_SAVE_INTERVAL
         while not shutdown:
             await gm.tick()
+            save_new_accounts(NEW_USERS_FILE)
+            autosave.poll()
+            if autosave.due():
+                autosave.start()
+                save_user_data(USERS_FILE)
+                next_delta_save = gm.game_time + DELTA_SAVE_INTERVAL
+            elif gm.game_time >= next_delta_save and not autosave.in_progress():
+                game_state_save_delta(gm, SAVE_FILE)
+                save_user_data(USERS_FILE)
+                next_delta_save = gm.game_time + DELTA_SAVE_INTERVAL
     finally:
-        save_user_data("users.json")
+        if world_ready.is_set():
+            save_user_data(USERS_FILE)
 
-net_io : NetIO = NetIO(gm.parse, send_message_to, update_user_data)
+net_io : NetIO = NetIO(gm.parse, send_messages_to, update_user_data, user_budget=4, tick_budget=256,
+                       encoders={ name: protocol.encode_message for name, protocol in PROTOCOLS.items() }, default_protocol=JSON.name)
+autosave : Autosave = Autosave(gm, SAVE_FILE, AUTOSAVE_INTERVAL)
 # on receive a message -> send to game to be parsed
 # on output -> add message to send loop
 
-async def send_loop():
-    while not shutdown:
-        try:
-            next_message = await to_send.get()
-            print(next_message)
-            await JOIN[next_message.user].send(json.dumps(asdict(next_message.data)))
-            print("Successfully sent.")
-        except TypeError as e:
-            print (e)
-
 async def handler(websocket):
     try:
         avatar = None
+        connection = None
         message = await websocket.recv()
         event = json.loads(message)
 
@@ -139,16 +304,25 @@ async def handler(websocket):
 
         user : str = event["user"]
         passwd : str = event["pass"]
+        protocol : Protocol = choose_protocol(event.get("protocol"), WIRE_PROTOCOLS)
+
+        # the server takes connections while the world is still loading, nothing can touch it until it's done
+        await world_ready.wait()
 
         if user in JOIN:
-            await send_message_websocket(websocket, f"Username {user} already exists on this server, please try logging on again with a different username.")
-            await websocket.send(json.dumps(asdict(SendData("disconnect", None))))
+            await send_message_websocket(websocket, f"Username {user} already exists on this server, please try logging on again with a different username.", protocol)
+            await websocket.send(protocol.disconnect_frame)
             raise ValueError
 
         user_obj = user_data.get(user)
 
         if user_obj == None:
-            room = get_first_with_name(gm, "Room")
+            # by id rather than by name, so that a lazily loaded world doesn't have to be read in full
+            room = [ gm.get_by_id(START_ROOM) ] if gm.get_by_id(START_ROOM) != None else get_first_with_name(gm, "Room")
+            if len(room) == 0:
+                await send_message_websocket(websocket, f"This server has nowhere to put new players, please try again later.", protocol)
+                await websocket.send(protocol.disconnect_frame)
+                raise ValueError
 
             avatar = GameObject()
             gm.imbue_reactions(avatar, {"listen_can_hear", "look_visible"})
@@ -158,23 +332,27 @@ async def handler(websocket):
 
             user_obj = UserData(user, bcrypt.hashpw(passwd.encode(), bcrypt.gensalt()).decode(), gm.obj_to_dict(avatar))
 
-            # add user data
+            # add user data, saved at the end of the tick
             user_data[user] = user_obj
+            new_accounts.append(user_obj)
 
         elif bcrypt.checkpw(passwd.encode(), user_obj.pass_hash.encode()):
             avatar = gm.obj_from_dict(user_obj.data)
         else:
-            await send_message_websocket(websocket, f"Password incorrect, please try again.")
-            await websocket.send(json.dumps(asdict(SendData("disconnect", None))))
+            await send_message_websocket(websocket, f"Password incorrect, please try again.", protocol)
+            await websocket.send(protocol.disconnect_frame)
             raise ValueError
 
         connected.add(websocket)
-        JOIN[event["user"]] = websocket
+        connection = Connection(user, websocket, net_io.output_totals, protocol=protocol)
+        JOIN[user] = connection
+        net_io.output_stats[user] = connection.stats
+        net_io.protocols[user] = protocol.name
 
         # ON USER CONNECT EVENT
         print ( f"User {event.get('user')} connected to server." )
 
-        await send_message_all(RichText(f"Welcome to the server, {user}.", color=1, bold=True))
+        send_message_all(RichText(f"Welcome to the server, {user}.", color=1, bold=True))
 
         # # create player object in server
         # room = get_first_with_name(gm, "Room")
@@ -186,6 +364,7 @@ async def handler(websocket):
         # gm.imbue_skills(avatar, {"look", "go", "say", "create", "destroy", "set", "list", "imbue", "inspect"})
 
         gm.add_object(avatar)
+        gm.log("add", obj=gm.obj_to_dict(avatar))
 
         net_io.add_user(user, avatar.id)
         # END ON USER CONNECT
@@ -197,27 +376,47 @@ async def handler(websocket):
 
     finally:
         if avatar != None:
+            update_user_data(user, gm.obj_to_dict(avatar))
             gm.remove_obj(avatar.id)
+            gm.log("remove", id=avatar.id)
             net_io.remove_id(avatar.id)
         print (f"User {user} disconnecting from server.")
         await websocket.close()
         if user in disconnecting:
-            # don't do any if not true, because this is an error
             disconnecting.remove(user)
-            del JOIN[user]
+        # only if the connection is ours; a second login under the same name is turned away before it gets one
+        if connection != None and JOIN.get(user) is connection:
+            JOIN.pop(user).close()
+            net_io.output_stats.pop(user, None)
+            net_io.protocols.pop(user, None)
         if websocket in connected:
             connected.remove(websocket)        
     
+def compression_options() -> dict:
+    if COMPRESSION == None:
+        return { "compression": None }
+    # the same as websockets' own deflate setup, with our settings
+    factory = ServerPerMessageDeflateFactory(
+        server_max_window_bits=DEFLATE_WINDOW_BITS,
+        client_max_window_bits=DEFLATE_WINDOW_BITS,
+        compress_settings={ "memLevel": DEFLATE_MEM_LEVEL, "level": DEFLATE_LEVEL }
+    )
+    return { "compression": None, "extensions": [ factory ] }
+
 async def main():
     port = 8001
     try:
-        async with websockets.serve(handler, "", port):
+        async with websockets.serve(handler, "", port, **compression_options()):
             print(f"Opening server on port {port}.")
-            send_task = asyncio.create_task(send_loop())
             game_task = asyncio.create_task(game_loop())
-            await asyncio.Future()
+            # the server runs as long as the game does, so a world that fails to load stops it rather than leaving
+            # logins waiting for world_ready
+            await game_task
     finally:
-        game_state_save(gm, "last_quit.json")
+        autosave.wait() # or it could finish after, and replace, the save below
+        # a world that didn't finish loading would be saved over the real one, and lose the deltas not yet applied
+        if world_ready.is_set():
+            game_state_save(gm, SAVE_FILE)
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
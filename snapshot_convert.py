@@ -0,0 +1,27 @@
+import sys
+from binary_snapshot import BinarySnapshot, is_binary_snapshot, write_binary_snapshot
+from game.setup import read_snapshot, write_snapshot
+
+# converts a saved world between the json and binary snapshot formats:
+#   python snapshot_convert.py IN OUT
+# the output is binary if the input is json and the other way round. pending deltas (IN.delta) aren't included, so
+# compact first if there are any.
+
+def to_binary(source : str, destination : str):
+    with open(source, mode="r", encoding="utf-8") as f:
+        header, objects = read_snapshot(f)
+        write_binary_snapshot(destination, header, objects)
+
+def to_json(source : str, destination : str):
+    snapshot = BinarySnapshot(source)
+    write_snapshot(destination, snapshot.header(), ( snapshot.load(obj_id) for obj_id in snapshot.iter_ids() ))
+    snapshot.close()
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python snapshot_convert.py IN OUT")
+        sys.exit(1)
+    if is_binary_snapshot(sys.argv[1]):
+        to_json(sys.argv[1], sys.argv[2])
+    else:
+        to_binary(sys.argv[1], sys.argv[2])
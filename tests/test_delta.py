@@ -0,0 +1,63 @@
+from magic_rpg import Game
+from interfaces.NetIO import NetIO
+from game.setup import game_state_save, game_state_save_delta, game_state_load, game_state_compact
+from game.setup import SKILLS, REACTIONS, SCRIPTS
+from game.utilities import create_object
+
+def make_game() -> Game:
+    game = Game(0.5)
+    game.set_interface(NetIO(game.parse, None, None))
+    return game
+
+def make_world() -> Game:
+    game = make_game()
+    game.add_skills(SKILLS)
+    game.add_reactions(REACTIONS)
+    game.add_scripts(SCRIPTS)
+    create_object(game, "Room", "A room.", id="room")
+    create_object(game, "Shouter", "Shouts.", "room", id="shouter")
+    create_object(game, "Box", "A box.", "room", id="box")
+    game.register_event("tick", "shouter", "shouter_on_tick")
+    game.schedule(30, "box", "shouter_on_timer", { "n": 1 }, "box-timer")
+    game.schedule(60, "shouter", "shouter_on_timer", None, "shouter-timer")
+    return game
+
+def loaded(file : str) -> Game:
+    game = make_game()
+    game_state_load(game, file)
+    return game
+
+def test_base_and_delta_keep_unchanged_listeners_and_timers(tmp_path):
+    file = str(tmp_path / "world.json")
+    game = make_world()
+    game_state_save(game, file)
+
+    # only the objects' states change, so the delta carries them but none of their listeners or timers
+    game.get_by_id("shouter").states["description"] = "Shouts louder."
+    game.get_by_id("box").states["description"] = "A bigger box."
+    game_state_save_delta(game, file)
+
+    reloaded = loaded(file)
+    assert reloaded.get_by_id("shouter").states["description"] == "Shouts louder."
+    assert reloaded.listeners_to_dict() == game.listeners_to_dict()
+    assert reloaded.timers_to_list() == game.timers_to_list()
+
+    # and the same as the compacted save
+    game_state_compact(file)
+    compacted = loaded(file)
+    assert compacted.listeners_to_dict() == reloaded.listeners_to_dict()
+    assert compacted.timers_to_list() == reloaded.timers_to_list()
+
+def test_delta_changes_to_listeners_and_timers_still_apply(tmp_path):
+    file = str(tmp_path / "world.json")
+    game = make_world()
+    game_state_save(game, file)
+
+    game.get_by_id("shouter").states["description"] = "Quiet now."
+    game.unregister_listener("shouter")
+    game.cancel("box-timer")
+    game_state_save_delta(game, file)
+
+    reloaded = loaded(file)
+    assert reloaded.listeners_to_dict() == {}
+    assert [ timer["id"] for timer in reloaded.timers_to_list() ] == ["shouter-timer"]
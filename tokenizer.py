@@ -0,0 +1,24 @@
+import re
+from functools import lru_cache
+
+# splits a command into arguments on whitespace. text in matching single or double quotes is kept together as one argument
+# (without the quotes), and an unterminated quote runs to the end of the line. shared by the server and the client so both
+# sides agree on what a command means.
+
+_TOKEN = re.compile(r'"([^"]*)"?|\'([^\']*)\'?|([^\s"\']+)')
+
+CACHE_SIZE = 1024
+
+def split_args(raw : str) -> list[str]:
+    return [ double or single or bare for double, single, bare in _TOKEN.findall(raw) ]
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _split_args_cached(raw : str) -> tuple[str, ...]:
+    return tuple(split_args(raw))
+
+def split_args_cached(raw : str) -> list[str]:
+    # for commands which repeat a lot, e.g. ones issued by scripts through Game.use_skill
+    return list(_split_args_cached(raw))
+
+def cache_info():
+    return _split_args_cached.cache_info()